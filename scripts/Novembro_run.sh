@@ -1 +1 @@
-python novembro.py -f feature-table.biom.txt -t taxonomy.tsv -s silva -o taxa_counts.tab
\ No newline at end of file
+python novembro.py -f feature-table.biom.txt -t taxonomy.tsv -s silva -o taxa_counts.tab -m ../metadata/MappingFile_mangue.csv -g Site
@@ -9,6 +9,8 @@
 	scripts_folder=/scratch/ps163/Dr_Carolina/scripts/
 	#joined_folder contains the completed joined files
 	joined_folder=/scratch/ps163/Dr_Carolina/qiime2/joined_fastq/
+	#casava_folder is where juntar.py --casava_folder writes the samples for import
+	casava_folder=/scratch/ps163/Dr_Carolina/qiime2/casava_fastq/
 	#qiime_results contains qiime run objects
 	qiime_results=/scratch/ps163/Dr_Carolina/qiime2/qiime_results/
 	#Mapping File contains metadata for samples
@@ -20,6 +22,13 @@
 	 --input-path ${joined_folder}/ \
 	 --input-format CasavaOneEightSingleLanePerSampleDirFmt \
 	 --output-path ${qiime_results}/demux-joined.qza
+#
+	#or, when juntar.py wrote the samples to a --casava_folder (it has a MANIFEST)
+	# qiime tools import \
+	#  --type 'SampleData[SequencesWithQuality]' \
+	#  --input-path ${casava_folder}/ \
+	#  --input-format SingleLanePerSampleSingleEndFastqDirFmt \
+	#  --output-path ${qiime_results}/demux-joined.qza
 #
 	qiime dada2 denoise-single \
 	 --i-demultiplexed-seqs ${qiime_results}/demux-joined.qza \
@@ -13,6 +13,8 @@ singularity shell core_2019.4.sif
 	vsearch_folder=/scratch/ps163/Dr_Carolina/qiime2/vsearch_join_fastq/
 	#joined_folder contains the completed joined files
 	joined_folder=/scratch/ps163/Dr_Carolina/qiime2/joined_fastq/
+	#casava_folder is where juntar.py --casava_folder writes the samples for import
+	casava_folder=/scratch/ps163/Dr_Carolina/qiime2/casava_fastq/
 	
 	
 	
@@ -34,14 +36,11 @@ singularity shell core_2019.4.sif
 			
 		qiime tools export --input-path ${vsearch_folder}/${new_sample_name}_joined.qza --output-path ${vsearch_folder}/exported-artifact
 		
-		gunzip -f ${vsearch_folder}/exported-artifact/*.gz
-		gunzip -f ${fastq_folder}/${sample_file}/*.gz
-			
 		python ${scripts_folder}/juntar.py \
-			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq \
-			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq \
-			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq \
-			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq
+			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq.gz \
+			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq.gz
 		
 		echo "Completed ${new_sample_name}. Saved to ${joined_folder}"
 			
@@ -63,14 +62,11 @@ singularity shell core_2019.4.sif
 			
 		qiime tools export --input-path ${vsearch_folder}/${new_sample_name}_joined.qza --output-path ${vsearch_folder}/exported-artifact
 		
-		gunzip -f ${vsearch_folder}/exported-artifact/*.gz
-		gunzip -f ${fastq_folder}/${sample_file}/*.gz
-			
 		python ${scripts_folder}/juntar.py \
-			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq \
-			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq \
-			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq \
-			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq
+			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq.gz \
+			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq.gz
 		
 		echo "Completed ${new_sample_name}. Saved to ${joined_folder}"
 			
@@ -92,14 +88,11 @@ singularity shell core_2019.4.sif
 			
 		qiime tools export --input-path ${vsearch_folder}/${new_sample_name}_joined.qza --output-path ${vsearch_folder}/exported-artifact
 		
-		gunzip -f ${vsearch_folder}/exported-artifact/*.gz
-		gunzip -f ${fastq_folder}/${sample_file}/*.gz
-			
 		python ${scripts_folder}/juntar.py \
-			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq \
-			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq \
-			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq \
-			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq
+			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq.gz \
+			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq.gz
 		
 		echo "Completed ${new_sample_name}. Saved to ${joined_folder}"
 		
@@ -122,14 +115,11 @@ singularity shell core_2019.4.sif
 			
 		qiime tools export --input-path ${vsearch_folder}/${new_sample_name}_joined.qza --output-path ${vsearch_folder}/exported-artifact
 		
-		gunzip -f ${vsearch_folder}/exported-artifact/*.gz
-		gunzip -f ${fastq_folder}/${sample_file}/*.gz
-			
 		python ${scripts_folder}/juntar.py \
-			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq \
-			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq \
-			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq \
-			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq
+			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq.gz \
+			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq.gz
 		
 		echo "Completed ${new_sample_name}. Saved to ${joined_folder}"
 			
@@ -151,14 +141,11 @@ singularity shell core_2019.4.sif
 			
 		qiime tools export --input-path ${vsearch_folder}/${new_sample_name}_joined.qza --output-path ${vsearch_folder}/exported-artifact
 		
-		gunzip -f ${vsearch_folder}/exported-artifact/*.gz
-		gunzip -f ${fastq_folder}/${sample_file}/*.gz
-			
 		python ${scripts_folder}/juntar.py \
-			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq \
-			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq \
-			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq \
-			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq
+			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq.gz \
+			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq.gz
 		
 		echo "Completed ${new_sample_name}. Saved to ${joined_folder}"
 			
@@ -180,14 +167,11 @@ singularity shell core_2019.4.sif
 			
 		qiime tools export --input-path ${vsearch_folder}/${new_sample_name}_joined.qza --output-path ${vsearch_folder}/exported-artifact
 		
-		gunzip -f ${vsearch_folder}/exported-artifact/*.gz
-		gunzip -f ${fastq_folder}/${sample_file}/*.gz
-			
 		python ${scripts_folder}/juntar.py \
-			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq \
-			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq \
-			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq \
-			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq
+			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq.gz \
+			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq.gz
 		
 		echo "Completed ${new_sample_name}. Saved to ${joined_folder}"
 #
@@ -210,14 +194,11 @@ singularity shell core_2019.4.sif
 			
 		qiime tools export --input-path ${vsearch_folder}/${new_sample_name}_joined.qza --output-path ${vsearch_folder}/exported-artifact
 		
-		gunzip -f ${vsearch_folder}/exported-artifact/*.gz
-		gunzip -f ${fastq_folder}/${sample_file}/*.gz
-			
 		python ${scripts_folder}/juntar.py \
-			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq \
-			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq \
-			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq \
-			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq
+			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq.gz \
+			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq.gz
 		
 		echo "Completed ${new_sample_name}. Saved to ${joined_folder}"
 			
@@ -239,14 +220,11 @@ singularity shell core_2019.4.sif
 			
 		qiime tools export --input-path ${vsearch_folder}/${new_sample_name}_joined.qza --output-path ${vsearch_folder}/exported-artifact
 		
-		gunzip -f ${vsearch_folder}/exported-artifact/*.gz
-		gunzip -f ${fastq_folder}/${sample_file}/*.gz
-			
 		python ${scripts_folder}/juntar.py \
-			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq \
-			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq \
-			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq \
-			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq
+			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq.gz \
+			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq.gz
 		
 		echo "Completed ${new_sample_name}. Saved to ${joined_folder}"
 			
@@ -268,13 +246,44 @@ singularity shell core_2019.4.sif
 			
 		qiime tools export --input-path ${vsearch_folder}/${new_sample_name}_joined.qza --output-path ${vsearch_folder}/exported-artifact
 		
-		gunzip -f ${vsearch_folder}/exported-artifact/*.gz
-		gunzip -f ${fastq_folder}/${sample_file}/*.gz
-			
 		python ${scripts_folder}/juntar.py \
-			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq \
-			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq \
-			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq \
-			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq
+			--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq.gz \
+			--vsearch ${vsearch_folder}/exported-artifact/${new_sample_name}_0_L001_R1_001.fastq.gz \
+			--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq.gz
 		
 		echo "Completed ${new_sample_name}. Saved to ${joined_folder}"
+
+	#Alternatively, once every sample has been imported, joined with vsearch and 
+	#exported to its own ${vsearch_folder}/<sample>/ folder, all samples in the 
+	#mapping file can be joined by a single juntar.py run:
+	#
+	#	python ${scripts_folder}/juntar.py \
+	#		--mapping_file /scratch/ps163/Dr_Carolina/metadata/MappingFile_mangue.csv \
+	#		--fastq_folder ${fastq_folder} \
+	#		--vsearch_folder ${vsearch_folder} \
+	#		--joined_folder ${joined_folder} \
+	#		--threads 32
+	#
+	#Or skip qiime vsearch join-pairs and the export altogether and let juntar.py 
+	#merge the pairs itself (quality aware, like vsearch) in the same pass:
+	#
+	#	python ${scripts_folder}/juntar.py \
+	#		--fastq_1 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R1_001.fastq.gz \
+	#		--fastq_2 ${fastq_folder}/${sample_file}/${new_sample_name}_0_L001_R2_001.fastq.gz \
+	#		--merge \
+	#		--output_file ${joined_folder}/${new_sample_name}_0_L001_R1_001.fastq.gz
+	#
+	#To have juntar.py write the folder qiime imports directly (gzipped on 
+	#--compress_threads threads, with a MANIFEST), add --casava_folder to the 
+	#mapping file run and import it with SingleLanePerSampleSingleEndFastqDirFmt, 
+	#see QIIME2_run.sh:
+	#
+	#	python ${scripts_folder}/juntar.py \
+	#		--mapping_file /scratch/ps163/Dr_Carolina/metadata/MappingFile_mangue.csv \
+	#		--fastq_folder ${fastq_folder} \
+	#		--vsearch_folder ${vsearch_folder} \
+	#		--joined_folder ${joined_folder} \
+	#		--casava_folder ${casava_folder} \
+	#		--compress_threads 4 \
+	#		--threads 32
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+batch_stats.py
+
+Chi-square tests for many contingency tables at once, used by novembro.py and
+sigilo.py. Each function gives, table by table, the same p-values as calling
+scipy.stats.chi2_contingency(obs, correction=True) on the table (the sums are
+done in the same order, so to the last bit), but for every taxon (or taxon x
+pathway) in a handful of array operations instead of one scipy call each.
+
+"""
+import numpy as np
+import scipy.stats as stats
+
+def contingency_tables(nums, dens):
+    '''
+    The (tables x k x 2) tables [[max(num, 1), den], ...] the site tests are
+    run on, from (tables x k) arrays of counts in and out of the taxon.
+    '''
+    nums = np.asarray(nums, dtype=float)
+    dens = np.asarray(dens, dtype=float)
+
+    return(np.stack([np.maximum(nums, 1), dens], axis=-1))
+
+def chi2_pvalues(tables, correction=True):
+    '''
+    chi2_contingency p-values of a (tables x k x 2) array. Yates' correction
+    is applied to 2 x 2 tables only (one degree of freedom), as scipy does.
+    '''
+    observed = np.asarray(tables, dtype=float)
+    tests, rows, columns = observed.shape
+
+    if not tests:
+        return(np.zeros(0))
+
+    total = observed.reshape(tests, -1).sum(axis=1)
+    expected = (observed.sum(axis=2, keepdims=True)*observed.sum(axis=1, keepdims=True))/total[:, None, None]
+
+    if np.any(expected == 0):
+        zero_table = np.nonzero((expected == 0).any(axis=(1, 2)))[0][0]
+        raise ValueError(("The internally computed table of expected frequencies of table {} has a zero element.").format(zero_table))
+
+    dof = (rows - 1)*(columns - 1)
+
+    if dof == 1 and correction:
+        diff = expected - observed
+        observed = observed + np.minimum(0.5, np.abs(diff))*np.sign(diff)
+
+    terms = (observed - expected)**2/expected
+    chi2 = terms.reshape(tests, -1).sum(axis=1)
+
+    return(stats.chi2.sf(chi2, dof))
+
+def chi2_kx2_pvalues(nums, dens):
+    '''
+    Site tests for (tables x k) counts in (nums) and out (dens) of each taxon:
+    the k x 2 table is tested when any site has more than 5 counts, otherwise
+    the p-value is 1. With k = 2 this is the pairwise run_chi2, with k = 3
+    sigilo's run_chi2x3.
+    '''
+    nums = np.asarray(nums, dtype=float)
+    pvalues = np.ones(nums.shape[0])
+
+    tested = (nums > 5).any(axis=1)
+    if tested.any():
+        pvalues[tested] = chi2_pvalues(contingency_tables(nums[tested], np.asarray(dens, dtype=float)[tested]))
+
+    return(pvalues)
@@ -3,8 +3,8 @@
 juntar.py
 Created on Wed Oct 21 22:06:48 2020
 
-This is intended to replace join reads from Qiime which allowed read joining 
-by pairs at less than 10 bp length. Additionally, if supplied, reads that can 
+This is intended to replace join reads from Qiime which allowed read joining
+by pairs at less than 10 bp length. Additionally, if supplied, reads that can
 be resolved using vsearch will take precedence over read joining.
 
 Standard usage:
@@ -12,12 +12,188 @@ Standard usage:
         --fastq_2 /path_to_reverse_read_file \
         --vsearch /path_to_vsearch_results_file \
         --output_file /path_for_output_files
-        
+
+Every sample in a mapping file, in one run:
+    python juntar.py --mapping_file MappingFile_mangue.csv \
+        --fastq_folder /path_to_raw_read_folders \
+        --vsearch_folder /path_to_exported_vsearch_joins \
+        --joined_folder /path_for_joined_files \
+        --threads 32
+
 v0.2:
     Added --minimum_overlap and --maximum_mismatch
-        
+v0.3:
+    Forward and reverse reads are streamed in step and each pair is joined and
+    written as it is read, memory no longer grows with the size of the run.
+    Mates that drift out of sync are held in a reorder buffer of at most
+    --reorder_buffer reads (default 10000), overflowing it is an error.
+v0.4:
+    Added --threads, pairs are joined in chunks of --chunk_size by a pool of
+    worker processes and written back in input order.
+v0.5:
+    --fastq_1, --fastq_2 and --vsearch may be gzipped (.gz), decompression runs
+    on a background thread. An --output_file ending in .gz is written gzipped
+    at --compress_level (default 6).
+v0.6:
+    compare_two finds the overlap with juntar_kernels.find_overlap, a seeded
+    scan that gives the same joins without building a slice per overlap length.
+v0.7:
+    Added --slide_algorithm. 'bitparallel' (default) runs the slide_compare_two
+    search for every unjoined pair of a chunk as one XOR and a table lookup per
+    pair, 'scan' is the original position by position loop. Both give the same
+    joins.
+v0.8:
+    R2 reads are reverse complemented and their qualities reversed a chunk at
+    a time with juntar_kernels.reverse_complement_batch / reverse_batch. All
+    IUPAC codes are complemented, not just ACGTN.
+v0.9:
+    Vsearch read IDs are kept as 64-bit fingerprints in sorted arrays instead
+    of a set of strings. The number of pairs joined here that vsearch had
+    already joined is reported as Total Vsearch Overlap.
+v0.10:
+    Added --mapping_file, --fastq_folder, --vsearch_folder and --joined_folder
+    to join every sample of a mapping file in one run. For each sample-id the
+    R1/R2 files are the *_R1_001.fastq[.gz] / *_R2_001.fastq[.gz] named after
+    it anywhere under --fastq_folder, the vsearch joins the *_R1_001 file
+    named after it under --vsearch_folder. Samples run in parallel and share
+    --threads between them, totals for all samples are written to
+    juntar_summary.log in --joined_folder.
+v0.11:
+    Added --join_cache, an LRU cache (default 50000 pairs per process, 0 turns
+    it off) of the join chosen for each (R1, R2) sequence pair, so duplicate
+    amplicons skip the overlap search. Copies of a pair within one chunk that
+    still waits for the slide search share its result and count as hits too.
+    Hits and evictions go to the log.
+v0.12:
+    Each run also writes a .json report next to the .log with per-stage wall
+    time and pairs per second, peak RSS, the exact (match_size) and slide
+    (save_size) overlap histograms, vsearch counts and why unjoined pairs were
+    rejected (too_short, no_overlap, over_mismatch).
+v0.13:
+    While joining, every --checkpoint_interval seconds (default 60, 0 turns it
+    off) the output is flushed to disk and a .checkpoint file records how many
+    R1/R2 records and output bytes are done. --resume picks up from there. R1
+    and R2 are positioned with a record-offset index built through mmap and
+    kept next to the checkpoint as <output>_R1.jidx / _R2.jidx (the offset of
+    every 1024th record, never in the raw read folder), gzipped inputs are
+    skipped forward instead. Gzipped output is written as one gzip member per
+    checkpoint so it can be cut back cleanly. The checkpoint records every
+    setting that changes the output (overlap, slide, quality, merge and
+    dereplication settings and the vsearch file), a resume with any other
+    values stops.
+v0.14:
+    --estimate N is a dry run: N pairs are reservoir sampled from the lane in
+    one streaming pass and only those are joined. The expected perfect join,
+    saved join and vsearch overlap fractions are reported with 95% (Wilson)
+    confidence intervals, scaled up to the whole lane, together with the
+    overlap length histogram. Nothing but the .estimate file is written.
+v0.15:
+    --sweep_overlap and --sweep_mismatch (comma separated) try every
+    combination of minimum_overlap and maximum_mismatch in one pass. Each
+    pair's longest exact overlap and slide hit pattern are found once and
+    every setting is decided from them, so the sweep costs about one join
+    rather than one per setting. Counts per setting go to the .sweep table,
+    --sweep_outputs also writes each setting's joined reads to
+    <output>_min<N>_err<N>.<ext>.
+v0.16:
+    Files too far out of sync for the reorder buffer no longer stop the run.
+    With --pairing auto (default) the rest of both files is cut into runs of
+    --sort_run_size reads, each sorted by read ID and spilled to a temporary
+    file in --temp_folder, and the runs are merged back and paired, so memory
+    stays bounded however the files are shuffled. Those pairs come out in
+    read ID order. --pairing sort does this from the start, --pairing stream
+    keeps the old behaviour of stopping when the buffer overflows.
+v0.17:
+    Joining runs as a pipeline. A reader thread parses and pairs the reads,
+    the main process joins them (itself or through the --threads pool) and a
+    writer thread formats each chunk into one buffer and writes it in a single
+    call. The stages hand chunks over through queues of at most
+    --queue_depth chunks (default 4), so memory stays bounded while reading,
+    joining and writing/compressing overlap. The .json report gains a
+    pipeline section: per queue the mean and max depth, how often the
+    producer found it full or the consumer found it empty (stalls) and the
+    seconds spent waiting. Mostly empty queues point at the stage before.
+v0.18:
+    Optional quality filtering in the join pass. --truncate_quality Q cuts
+    each joined read at its first base at or below Q (reads left shorter than
+    --minimum_truncated_length, default 1, are dropped), then --max_ee drops
+    joined reads with more expected errors than given. --qc_table writes
+    <output>.qc, per position of R1, R2 (both by cycle) and the joined reads:
+    reads, mean quality and the fractions below Q20 and at Q30 or above.
+    The joined columns cover the reads written, perfect joins left out for
+    being in vsearch are not counted. Vsearch reads are copied as they are
+    and are not filtered or counted.
+v0.19:
+    --merge runs a quality aware overlap merge on every pair in the join pass,
+    in place of qiime vsearch join-pairs and its export. As in vsearch
+    fastq_mergepairs, candidate overlaps are scored with quality based log
+    odds, the best is kept if it has at most --merge_maximum_diffs (10)
+    mismatches over at least --merge_minimum_overlap (10) bases and scores
+    --merge_minimum_score (16) bits, and the overlap gets consensus bases
+    with posterior qualities. Merged reads are treated exactly like an
+    imported vsearch file: written first, counted as the vsearch import, and
+    perfect joins of merged pairs are left out.
+v0.20:
+    --dereplicate alongside|instead collapses the written reads (vsearch,
+    merged and joined) to unique sequences on the fly with a hash table.
+    Each unique sequence is written once, most abundant first, as
+    @<first read id>;size=<count> with the mean quality at every position,
+    to <output>_derep.<ext> next to the full output or, with instead, as
+    the output itself. The .log gives the unique count and the reads per
+    unique sequence. Checkpoints are not taken while dereplicating.
+v0.21:
+    --compress_threads N (default 1) gzips .gz output on N threads: the
+    output is cut into blocks that are compressed as separate gzip members
+    at the same time and written back in order. With --mapping_file,
+    --casava_folder writes every sample straight into a folder qiime can
+    import, as <sample-id>_S<n>_L001_R1_001.fastq.gz (n being the sample's
+    place in the mapping file) with a MANIFEST and metadata.yml. Each
+    sample's .log, .json and other side files go to --joined_folder so
+    the folder holds nothing qiime does not expect. Import it with
+    --input-format SingleLanePerSampleSingleEndFastqDirFmt.
+v0.22:
+    --adaptive_overlap N learns which overlap lengths the perfect joins
+    have (the match_size tally) over the first N pairs each process
+    searches. After that the most common lengths are checked first, before
+    falling through to the full search, which still makes sure no longer
+    overlap exists, so the joins are the same. As many of the most common
+    lengths are tried first (up to 8, possibly none) as the window says
+    will need the fewest checks per pair, so a flat overlap histogram
+    keeps the plain search. The .log and .json give the overlap lengths
+    checked per pair during the learning window and after it.
+
 """
 import argparse
+from array import array
+from bisect import bisect_left
+import concurrent.futures
+import glob
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import math
+import mmap
+import os
+import random
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import deque, OrderedDict
+from itertools import chain, islice, zip_longest
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    #not available on Windows, peak RSS is then left out of the report
+    resource = None
+
+from juntar_kernels import expected_errors, find_overlap, find_overlap_ordered, iupac_complement, merge_batch, quality_columns, reverse_batch, reverse_complement_batch, slide_hit_patterns, slide_overlap_batch, slide_table, truncate_position
 
 parser = argparse.ArgumentParser()
 
@@ -26,191 +202,1781 @@ parser.add_argument('-f2',"--fastq_2")
 parser.add_argument('-v',"--vsearch")
 parser.add_argument('-min',"--minimum_overlap")
 parser.add_argument('-err',"--maximum_mismatch")
+parser.add_argument('-slide',"--slide_algorithm", choices=['bitparallel', 'scan'])
+parser.add_argument('-buf',"--reorder_buffer")
+parser.add_argument('-pair',"--pairing", choices=['auto', 'stream', 'sort'])
+parser.add_argument('-run',"--sort_run_size")
+parser.add_argument('-tmp',"--temp_folder")
+parser.add_argument('-t',"--threads")
+parser.add_argument('-chunk',"--chunk_size")
+parser.add_argument('-cache',"--join_cache")
+parser.add_argument('-adapt',"--adaptive_overlap")
+parser.add_argument('-qd',"--queue_depth")
+parser.add_argument('-truncq',"--truncate_quality")
+parser.add_argument('-minlen',"--minimum_truncated_length")
+parser.add_argument('-maxee',"--max_ee")
+parser.add_argument('-qc',"--qc_table", action='store_true')
+parser.add_argument('-merge',"--merge", action='store_true')
+parser.add_argument('-movl',"--merge_minimum_overlap")
+parser.add_argument('-mdiff',"--merge_maximum_diffs")
+parser.add_argument('-mscore',"--merge_minimum_score")
+parser.add_argument('-derep',"--dereplicate", choices=['alongside', 'instead'])
+parser.add_argument('-ckpt',"--checkpoint_interval")
+parser.add_argument('-resume',"--resume", action='store_true')
+parser.add_argument('-est',"--estimate")
+parser.add_argument('-smin',"--sweep_overlap")
+parser.add_argument('-serr',"--sweep_mismatch")
+parser.add_argument('-sout',"--sweep_outputs", action='store_true')
 parser.add_argument('-o',"--output_file")
+parser.add_argument('-gzl',"--compress_level")
+parser.add_argument('-gzt',"--compress_threads")
+
+parser.add_argument('-map',"--mapping_file")
+parser.add_argument('-fq',"--fastq_folder")
+parser.add_argument('-vs',"--vsearch_folder")
+parser.add_argument('-jf',"--joined_folder")
+parser.add_argument('-casava',"--casava_folder")
 
-args = parser.parse_args()
+minimum_overlap = 4
+maximum_mismatch = 1
+slide_algorithm = 'bitparallel'
+reorder_buffer = 10000
+pairing = 'auto'
+sort_run_size = 500000
+temp_folder = None
+threads = 1
+chunk_size = 10000
+compress_level = 6
+compress_threads = 1
+join_cache_size = 50000
+adaptive_overlap = 0
+truncate_quality = None
+minimum_truncated_length = 1
+max_ee = None
+qc_table = False
+merge_reads = False
+merge_minimum_overlap = 10
+merge_maximum_diffs = 10
+merge_minimum_score = 16.0
+dereplicate = None
+queue_depth = 4
+checkpoint_interval = 60
+resume = False
+index_step = 1024
+sweep_grid = []
+sweep_outputs = False
 
-if args.minimum_overlap:
-    minimum_overlap = int(args.minimum_overlap)
-else:
-    minimum_overlap = 4
-    
-if args.maximum_mismatch:
-    maximum_mismatch = int(args.maximum_mismatch)
-else:
-    maximum_mismatch = 1
+#(f1_seq, f2_seq) -> (join_type, index), least recently used first
+join_cache = OrderedDict()
+
+#this process's --adaptive_overlap learning window and the lengths learned from it
+overlap_window = {'pairs':0, 'comparisons':0, 'match_size':{}, 'likely':None}
 
 def reverse_compliment(oldstr):
-    comp_dict = {'A':'T', 'T':'A', 'C':'G', 'G':'C', 'N':'N'}
-    newstr = ''
-    isstr = oldstr[::-1]
-    
-    for each in isstr:
-        newstr += (comp_dict[each])
-
-    return(newstr)
-    
-def compare_two(f1_seq, f2_seq, f1_q, f2_q):
-    global match_size
-    
-    for index in range(100, (minimum_overlap-1), -1):
-        if f1_seq[(-1*index):] == f2_seq[:index]:
-            
-            f3_seq = f1_seq + f2_seq[index:]
-            f3_q = f1_q + f2_q[index:]
-            
-            if len(f3_seq) != len(f3_q):
-                print('seq v q error')
-                print(len(f3_seq), len(f3_q))
-                1/0
-            
-            if len(f3_seq) >= 250:
-                if index not in match_size:
-                    match_size[index] = 0
-                
-                match_size[index]+=1
-            
-                return(f3_seq, f3_q)               
-            
-    return(0, 0)
-    
-def slide_compare_two(f1_seq, f2_seq, f1_q, f2_q):
+    return(oldstr.translate(iupac_complement)[::-1])
+
+def build_join(f1_seq, f2_seq, f1_q, f2_q, index, size_dict):
+    #joins the pair at an overlap index, -1 meaning no join
+    if index == -1:
+        return(0, 0)
+
+    f3_seq = f1_seq + f2_seq[index:]
+    f3_q = f1_q + f2_q[index:]
+
+    if len(f3_seq) != len(f3_q):
+        print('seq v q error')
+        print(len(f3_seq), len(f3_q))
+        1/0
+
+    if index not in size_dict:
+        size_dict[index] = 0
+
+    size_dict[index]+=1
+
+    return(f3_seq, f3_q)
+
+def compare_two(f1_seq, f2_seq, f1_q, f2_q, match_size):
+    index = find_overlap(f1_seq, f2_seq, minimum_overlap)
+
+    if not index:
+        return(0, 0)
+
+    return(build_join(f1_seq, f2_seq, f1_q, f2_q, index, match_size))
+
+def slide_scan(f1_seq, f2_seq):
+    hit=0
+    miss=0
+
+    for index in range(10):
+        if f1_seq[(-1*index)-1] == f2_seq[index]:
+            hit += 1
+        else:
+            miss += 1
+
+        if hit >= (minimum_overlap*2)-1:
+            if (len(f1_seq) + len(f2_seq[index:])) >= 250:
+                return(index)
+
+        if miss > maximum_mismatch:
+            return(-1)
+
+    return(-1)
+
+def reject_reason(f1_seq, f2_seq):
+    '''
+    Why a pair neither search could join was rejected: 'too_short' if either
+    search found an overlap but the join was under 250 bp, 'over_mismatch' if
+    the slide search ran past maximum_mismatch, otherwise 'no_overlap'.
+    '''
+    if find_overlap(f1_seq, f2_seq, minimum_overlap, minimum_length=0):
+        return('too_short')
+
     hit=0
     miss=0
-    
-    for index in range(10):        
+
+    for index in range(min(10, len(f1_seq), len(f2_seq))):
         if f1_seq[(-1*index)-1] == f2_seq[index]:
             hit += 1
         else:
             miss += 1
-            
+
         if hit >= (minimum_overlap*2)-1:
-            f3_seq = f1_seq + f2_seq[index:]
-            f3_q = f1_q + f2_q[index:]
-            
-            if len(f3_seq) != len(f3_q):
-                print('seq v q error')
-                print(len(f3_seq), len(f3_q))
-                1/0
-            
-            if len(f3_seq) >= 250:
-                if index not in save_size:
-                    save_size[index] = 0
-                
-                save_size[index]+=1
-            
-                return(f3_seq, f3_q) 
-        
+            return('too_short')
+
         if miss > maximum_mismatch:
-            return(0,0)
-            
-    return(0, 0)
-
-f1 = open(args.fastq_1)
-f2 = open(args.fastq_2)
-f3 = open(args.output_file, 'w')
-f_log = open(args.output_file.split('.')[0] + '.log','w')
-    
-fi_dict = {}
-fii_dict = {}
-
-match_size = {}
-total_hit = 0
-
-save_size = {}
-total_save = 0
-
-v_set = set()
-vmatch_set = set()
-
-if args.vsearch:
-    v1 = open(args.vsearch)
-    
+            return('over_mismatch')
+
+    return('no_overlap')
+
+def slide_indexes(f1_seqs, f2_seqs):
+    if slide_algorithm == 'bitparallel':
+        return(slide_overlap_batch(f1_seqs, f2_seqs, (minimum_overlap*2)-1, maximum_mismatch))
+
+    return([slide_scan(f1_seq, f2_seq) for f1_seq, f2_seq in zip(f1_seqs, f2_seqs)])
+
+def slide_compare_two(f1_seq, f2_seq, f1_q, f2_q, save_size):
+    index = slide_indexes([f1_seq], [f2_seq])[0]
+
+    return(build_join(f1_seq, f2_seq, f1_q, f2_q, index, save_size))
+
+def background_lines(file_name, block_size=1048576, depth=8):
+    '''
+    Decompresses file_name on a background thread and yields its lines, so
+    gunzip overlaps with joining. Lines are handed over in blocks of roughly
+    block_size characters, at most depth blocks are held in memory.
+    '''
+    line_queue = queue.Queue(maxsize=depth)
+
+    def fill_queue():
+        try:
+            infile = gzip.open(file_name, 'rt')
+            lines = infile.readlines(block_size)
+            while lines:
+                line_queue.put(lines)
+                lines = infile.readlines(block_size)
+            infile.close()
+            line_queue.put(None)
+        except Exception as err:
+            line_queue.put(err)
+
+    reader = threading.Thread(target=fill_queue, daemon=True)
+    reader.start()
+
+    lines = line_queue.get()
+    while lines is not None:
+        if isinstance(lines, Exception):
+            raise lines
+        yield from lines
+        lines = line_queue.get()
+
+def open_fastq(file_name):
+    if file_name.endswith('.gz'):
+        return(background_lines(file_name))
+
+    return(open(file_name))
+
+class ParallelGzipWriter:
+    '''
+    Text writer for gzip output on several threads. What is written is cut
+    into blocks of block_size bytes, each block is compressed as a gzip
+    member of its own on the thread pool (zlib lets go of the GIL while it
+    compresses) and the members are written to raw in order. Closing it
+    writes what is left but leaves raw open, like GzipFile.
+    '''
+    def __init__(self, raw, threads, block_size=4194304):
+        self.raw = raw
+        self.threads = threads
+        self.block_size = block_size
+        self.pool = concurrent.futures.ThreadPoolExecutor(threads)
+        self.pending = deque()
+        self.blocks = []
+        self.buffered = 0
+
+    def write(self, text):
+        block = text.encode()
+        self.blocks.append(block)
+        self.buffered += len(block)
+        if self.buffered >= self.block_size:
+            self.submit()
+        return(len(text))
+
+    def submit(self):
+        if self.buffered:
+            self.pending.append(self.pool.submit(gzip.compress, b''.join(self.blocks), compress_level))
+            self.blocks = []
+            self.buffered = 0
+
+        #a couple of blocks per thread in flight keeps them busy without holding the whole output
+        while len(self.pending) > 2*self.threads:
+            self.raw.write(self.pending.popleft().result())
+
+    def flush(self):
+        self.submit()
+        while self.pending:
+            self.raw.write(self.pending.popleft().result())
+        self.raw.flush()
+
+    def close(self):
+        self.flush()
+        self.pool.shutdown()
+
+def new_writer(file_name, raw):
+    if file_name.endswith('.gz'):
+        if compress_threads > 1:
+            return(ParallelGzipWriter(raw, compress_threads))
+        return(io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=compress_level)))
+
+    return(io.TextIOWrapper(raw))
+
+def open_output(file_name, resume_bytes=None):
+    '''
+    Returns the raw output file and a text writer on it. When resuming, the
+    file is first cut back to the last checkpoint.
+    '''
+    if resume_bytes is None:
+        raw = open(file_name, 'wb')
+    else:
+        raw = open(file_name, 'r+b')
+        raw.truncate(resume_bytes)
+        raw.seek(resume_bytes)
+
+    return(raw, new_writer(file_name, raw))
+
+def commit_output(file_name, raw, writer):
+    '''
+    Gets everything written so far onto disk and returns the writer to carry
+    on with and the committed size. For gzip output the current member is
+    finished and a new one started, so the committed bytes are a complete
+    gzip file on their own.
+    '''
+    if file_name.endswith('.gz'):
+        #closing the GzipFile writes its trailer but leaves raw open
+        writer.close()
+        raw.flush()
+        committed = raw.tell()
+        writer = new_writer(file_name, raw)
+    else:
+        writer.flush()
+        committed = raw.tell()
+
+    os.fsync(raw.fileno())
+
+    return(writer, committed)
+
+def close_output(raw, writer):
+    writer.close()
+    if not raw.closed:
+        raw.close()
+
+def build_record_index(file_name):
+    #byte offset of every index_step-th record, found by scanning the file through mmap
+    offsets = array('Q')
+
+    infile = open(file_name, 'rb')
+    if os.path.getsize(file_name) == 0:
+        infile.close()
+        return(offsets)
+
+    mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    size = len(mapped)
+    position = 0
+    record = 0
+
+    while position < size:
+        if record % index_step == 0:
+            offsets.append(position)
+
+        for _line in range(4):
+            position = mapped.find(b'\n', position) + 1
+            if position == 0:
+                position = size
+                break
+
+        record += 1
+
+    mapped.close()
+    infile.close()
+
+    return(offsets)
+
+def load_record_index(file_name, index_name):
+    '''
+    Loads the index_name index if it was built for this exact file, otherwise
+    builds it and tries to save it there. The first three values are
+    index_step, file size and mtime.
+    '''
+    stat = os.stat(file_name)
+    header = array('Q', [index_step, stat.st_size, stat.st_mtime_ns])
+
+    if os.path.isfile(index_name):
+        index_file = open(index_name, 'rb')
+        record_index = array('Q')
+        record_index.frombytes(index_file.read())
+        index_file.close()
+
+        if record_index[:3] == header:
+            return(record_index[3:])
+
+    offsets = build_record_index(file_name)
+
+    try:
+        index_file = open(index_name, 'wb')
+        (header + offsets).tofile(index_file)
+        index_file.close()
+    except OSError:
+        pass
+
+    return(offsets)
+
+def open_fastq_at(file_name, record, index_name=None):
+    '''
+    open_fastq positioned at a record number. Plain files seek to the nearest
+    indexed record (kept in index_name, if given) and skip the rest, gzipped
+    files skip from the start.
+    '''
+    if (record == 0) or file_name.endswith('.gz'):
+        fastq_file = open_fastq(file_name)
+        skip_lines = 4*record
+    else:
+        if index_name:
+            offsets = load_record_index(file_name, index_name)
+        else:
+            offsets = build_record_index(file_name)
+        block = min(record // index_step, len(offsets) - 1)
+
+        raw = open(file_name, 'rb')
+        raw.seek(offsets[block])
+        fastq_file = io.TextIOWrapper(raw)
+        skip_lines = 4*(record - block*index_step)
+
+    for _line in islice(fastq_file, skip_lines):
+        pass
+
+    return(fastq_file)
+
+def read_fastq_range(file_name, start_record, end_record):
+    #records start_record up to end_record, for handing out slices of a file
+    fastq_file = open_fastq_at(file_name, start_record)
+    yield from islice(read_fastq(fastq_file), end_record - start_record)
+    fastq_file.close()
+
+def id_fingerprint(read_id):
+    return(int.from_bytes(hashlib.blake2b(read_id.encode(), digest_size=8).digest(), 'big'))
+
+def build_id_index(read_ids):
+    '''
+    Compact set of read IDs, 8 bytes per ID. Fingerprints are bucketed on their
+    top byte into 256 arrays which are sorted one at a time, so building never
+    needs more than a bucket's worth of Python ints. At 64 bits a false hit
+    is ~1e-5 likely even for 20M IDs.
+    '''
+    id_index = [array('Q') for _bucket in range(256)]
+
+    for read_id in read_ids:
+        fingerprint = id_fingerprint(read_id)
+        id_index[fingerprint >> 56].append(fingerprint)
+
+    for bucket in range(256):
+        id_index[bucket] = array('Q', sorted(id_index[bucket]))
+
+    return(id_index)
+
+def in_id_index(id_index, read_id):
+    fingerprint = id_fingerprint(read_id)
+    bucket = id_index[fingerprint >> 56]
+    index = bisect_left(bucket, fingerprint)
+
+    return((index < len(bucket)) and (bucket[index] == fingerprint))
+
+def copy_vsearch(vsearch_file, outfile, derep=None):
+    #copies the vsearch joins to the output (if any), yielding their read IDs
     ct = 0
-    for line in v1:
-        f3.write(line)
+    for line in vsearch_file:
+        if outfile:
+            outfile.write(line)
         ct+=1
         if ct == 1:
             read_id = line.split(' ')[0]
-            v_set.add(read_id)
+            yield(read_id)
+        if ct == 2:
+            seq = line.strip()
         if ct == 4:
-            ct = 0 
-
-    v1.close()
-
-ct = 0
-for line in f1:
-    ct+=1
-    if ct == 1:
-        read_id = line.split(' ')[0]
-        fi_dict[read_id]={'s':'', 'q':''}
-    if ct == 2:
-        fi_dict[read_id]['s'] = line.strip()
-    if ct == 4:
-        fi_dict[read_id]['q'] = line.strip()
-        ct = 0  
-f1.close()
-
-ct = 0
-for line in f2:
-    ct+=1
-    if ct == 1:
-        read_id = line.split(' ')[0]
-        fii_dict[read_id]={'s':'', 'q':''}
-    if ct == 2:
-        fii_dict[read_id]['s'] = reverse_compliment(line.strip())
-    if ct == 4:
-        line = line.strip()
-        line = line[::-1]
-        fii_dict[read_id]['q'] = line
-        ct = 0  
-f2.close()
-    
-for read_id in fi_dict:
-    if (read_id in fii_dict):
+            if derep is not None:
+                add_derep(derep, read_id, seq, line.strip())
+            ct = 0
+
+def add_derep(derep, read_id, seq, qual):
+    '''
+    Counts seq in the dereplication table, keeping the first read ID and
+    the summed quality per position. The quality string is encoded as
+    UTF-32 and read as one int, which puts each position in its own 32 bit
+    lane, so a single int addition sums every position at once.
+    '''
+    lanes = int.from_bytes(qual.encode('utf-32-le'), 'little')
+    entry = derep.get(seq)
+
+    if entry:
+        entry[0] += 1
+        entry[2] += lanes
+    else:
+        derep[seq] = [1, read_id, lanes]
+
+def write_derep(file_name, derep):
+    #unique sequences, most abundant first, with their mean qualities
+    derep_raw, derep_file = open_output(file_name)
+
+    for seq, (count, read_id, lanes) in sorted(derep.items(), key=lambda entry: (-entry[1][0], entry[0])):
+        sums = array('I', lanes.to_bytes(4*len(seq), 'little'))
+        if sys.byteorder == 'big':
+            sums.byteswap()
+        qual = bytes([round(total/count) for total in sums]).decode()
+        derep_file.write(('{};size={}\n{}\n+\n{}\n').format(read_id.rstrip('\n'), count, seq, qual))
+
+    close_output(derep_raw, derep_file)
+
+def log_prefix(output_file):
+    #output path up to the first '.' of the file name, the .log / .json go there
+    return(os.path.join(os.path.dirname(output_file), os.path.basename(output_file).split('.')[0]))
+
+def read_fastq(fastq_file):
+    #yields (read_id, seq, qual) one record at a time
+    for header, seq, _plus, qual in zip(fastq_file, fastq_file, fastq_file, fastq_file):
+        yield(header.split(' ')[0], seq.strip(), qual.strip())
+
+def pair_reads(f1_reads, f2_reads, tally):
+    '''
+    Walks both read files in step. In sync files never touch the buffers,
+    out of sync mates wait in f1_pending / f2_pending until their partner
+    turns up. Forward and reverse reads are counted in tally['total_reads']
+    and tally['reverse_reads'], tally['pending'] is the reorder buffer size.
+    If the buffer overflows the rest is paired by sort_merge_pairs.
+    '''
+    if pairing == 'sort':
+        yield from sort_merge_pairs(f1_reads, f2_reads, tally)
+        return
+
+    f1_pending = {}
+    f2_pending = {}
+
+    for f1_rec, f2_rec in zip_longest(f1_reads, f2_reads):
+        if f1_rec:
+            tally['total_reads'] += 1
+
+        if f2_rec:
+            tally['reverse_reads'] += 1
+
+        if f1_rec and f2_rec and (f1_rec[0] == f2_rec[0]):
+            yield(f1_rec[0], f1_rec[1], f1_rec[2], f2_rec[1], f2_rec[2])
+            continue
+
+        if f1_rec:
+            read_id, f1_seq, f1_q = f1_rec
+            if read_id in f2_pending:
+                f2_seq, f2_q = f2_pending.pop(read_id)
+                yield(read_id, f1_seq, f1_q, f2_seq, f2_q)
+            else:
+                f1_pending[read_id] = (f1_seq, f1_q)
+
+        if f2_rec:
+            read_id, f2_seq, f2_q = f2_rec
+            if read_id in f1_pending:
+                f1_seq, f1_q = f1_pending.pop(read_id)
+                yield(read_id, f1_seq, f1_q, f2_seq, f2_q)
+            else:
+                f2_pending[read_id] = (f2_seq, f2_q)
+
+        tally['pending'] = len(f1_pending) + len(f2_pending)
+
+        if (tally['pending'] > reorder_buffer) and (pairing == 'stream'):
+            outline = ('Forward and reverse reads are out of sync by more than {} reads near {}. '
+                       'Sort both files by read name or raise --reorder_buffer.').format(reorder_buffer, read_id)
+            sys.exit(outline)
+
+        if tally['pending'] > reorder_buffer:
+            print(('Forward and reverse reads are out of sync by more than {} reads near {}, '
+                   'pairing the rest by sorting on read name').format(reorder_buffer, read_id))
+
+            f1_rest = chain(((read_id, f1_seq, f1_q) for read_id, (f1_seq, f1_q) in f1_pending.items()), count_reads(f1_reads, tally, 'total_reads'))
+            f2_rest = chain(((read_id, f2_seq, f2_q) for read_id, (f2_seq, f2_q) in f2_pending.items()), count_reads(f2_reads, tally, 'reverse_reads'))
+            yield from sort_merge_pairs(f1_rest, f2_rest, tally, counted=True)
+            return
+
+    if f1_pending or f2_pending:
+        print(('\tUnpaired reads:\t{}\t{}\n').format(len(f1_pending), len(f2_pending)))
+
+def count_reads(reads, tally, key):
+    for read in reads:
+        tally[key] += 1
+        yield(read)
+
+def spill_runs(reads, run_prefix):
+    '''
+    Cuts reads into sort_run_size runs, sorts each by read ID and writes it
+    to its own tab separated file. Returns the run file names.
+    '''
+    run_names = []
+
+    run = list(islice(reads, sort_run_size))
+    while run:
+        run.sort()
+        run_name = ('{}_{}.run').format(run_prefix, len(run_names))
+        run_file = open(run_name, 'w')
+        for read_id, seq, qual in run:
+            #IDs without a description still carry their newline
+            run_file.write(('{}\t{}\t{}\n').format(read_id.rstrip('\n'), seq, qual))
+        run_file.close()
+
+        run_names.append(run_name)
+        run = list(islice(reads, sort_run_size))
+
+    return(run_names)
+
+def read_run(run_name):
+    run_file = open(run_name)
+    for line in run_file:
+        yield(tuple(line[:-1].split('\t')))
+    run_file.close()
+
+def sort_merge_pairs(f1_reads, f2_reads, tally, counted=False):
+    '''
+    Pairs reads whatever their order with bounded memory, see the v0.16
+    note. Both sides are spilled to sorted runs, the runs of each side are
+    merged with heapq.merge and the two sorted streams are walked together.
+    Reads are counted in the tally unless the caller already does.
+    '''
+    if not counted:
+        f1_reads = count_reads(f1_reads, tally, 'total_reads')
+        f2_reads = count_reads(f2_reads, tally, 'reverse_reads')
+
+    sort_folder = tempfile.mkdtemp(prefix='juntar_sort_', dir=temp_folder)
+
+    try:
+        f1_runs = spill_runs(f1_reads, os.path.join(sort_folder, 'R1'))
+        f2_runs = spill_runs(f2_reads, os.path.join(sort_folder, 'R2'))
+        #no checkpoints from here on, the input position means nothing now
+        tally['sort_runs'] = len(f1_runs) + len(f2_runs)
+
+        f1_sorted = heapq.merge(*[read_run(run_name) for run_name in f1_runs])
+        f2_sorted = heapq.merge(*[read_run(run_name) for run_name in f2_runs])
+
+        f1_unpaired = 0
+        f2_unpaired = 0
+        f1_rec = next(f1_sorted, None)
+        f2_rec = next(f2_sorted, None)
+
+        while f1_rec and f2_rec:
+            if f1_rec[0] == f2_rec[0]:
+                yield(f1_rec[0], f1_rec[1], f1_rec[2], f2_rec[1], f2_rec[2])
+                f1_rec = next(f1_sorted, None)
+                f2_rec = next(f2_sorted, None)
+            elif f1_rec[0] < f2_rec[0]:
+                f1_unpaired += 1
+                f1_rec = next(f1_sorted, None)
+            else:
+                f2_unpaired += 1
+                f2_rec = next(f2_sorted, None)
+
+        f1_unpaired += sum(1 for _rec in f1_sorted) + bool(f1_rec)
+        f2_unpaired += sum(1 for _rec in f2_sorted) + bool(f2_rec)
+
+        if f1_unpaired or f2_unpaired:
+            print(('\tUnpaired reads:\t{}\t{}\n').format(f1_unpaired, f2_unpaired))
+
+    finally:
+        shutil.rmtree(sort_folder, ignore_errors=True)
+
+def join_settings():
+    return({'minimum_overlap': minimum_overlap, 'maximum_mismatch': maximum_mismatch,
+            'slide_algorithm': slide_algorithm, 'reorder_buffer': reorder_buffer,
+            'pairing': pairing, 'sort_run_size': sort_run_size, 'temp_folder': temp_folder,
+            'chunk_size': chunk_size, 'compress_level': compress_level, 'compress_threads': compress_threads,
+            'join_cache_size': join_cache_size, 'adaptive_overlap': adaptive_overlap, 'queue_depth': queue_depth,
+            'checkpoint_interval': checkpoint_interval,
+            'resume': resume, 'sweep_grid': sweep_grid, 'sweep_outputs': sweep_outputs,
+            'truncate_quality': truncate_quality, 'minimum_truncated_length': minimum_truncated_length,
+            'max_ee': max_ee, 'qc_table': qc_table, 'merge_reads': merge_reads,
+            'merge_minimum_overlap': merge_minimum_overlap, 'merge_maximum_diffs': merge_maximum_diffs,
+            'merge_minimum_score': merge_minimum_score, 'dereplicate': dereplicate})
+
+def set_join_settings(settings):
+    #pool initializer, so workers agree with the parent whatever the start method
+    globals().update(settings)
+
+def cache_join(cache_key, cached, chunk_tally):
+    join_cache[cache_key] = cached
+
+    if len(join_cache) > join_cache_size:
+        join_cache.popitem(last=False)
+        chunk_tally['cache_evictions'] += 1
+
+def adaptive_find_overlap(f1_seq, f2_seq, overlap_search):
+    #find_overlap, trying the learned lengths first once there are any
+    if overlap_window['likely'] is None:
+        index, comparisons = find_overlap_ordered(f1_seq, f2_seq, minimum_overlap, ())
+        stage = 'learning'
+    else:
+        index, comparisons = find_overlap_ordered(f1_seq, f2_seq, minimum_overlap, overlap_window['likely'])
+        stage = 'adapted'
+
+    overlap_search[stage + '_pairs'] += 1
+    overlap_search[stage + '_comparisons'] += comparisons
+
+    return(index)
+
+def learn_overlaps(match_size, overlap_search):
+    '''
+    Adds a chunk's perfect join overlaps to the learning window. Once
+    adaptive_overlap pairs have been searched, the most common lengths
+    become the ones tried first. Trying the first k of them costs about
+    i checks for a pair joined at the i-th and k more than the plain
+    search for every other pair, k (at most 8) is the one expected to
+    cost least over the window, 0 when the plain search already wins.
+    '''
+    overlap_window['pairs'] += overlap_search['learning_pairs']
+    overlap_window['comparisons'] += overlap_search['learning_comparisons']
+    merge_tally(overlap_window['match_size'], match_size)
+
+    if overlap_window['pairs'] < adaptive_overlap:
+        return
+
+    pairs = overlap_window['pairs']
+    plain = overlap_window['comparisons']/pairs
+    ranked = sorted(overlap_window['match_size'].items(), key=lambda each: (-each[1], -each[0]))[:8]
+
+    likely = []
+    best = plain
+    first_checks = 0
+    first_pairs = 0
+
+    for rank, (overlap, ct) in enumerate(ranked, 1):
+        first_checks += rank*ct
+        first_pairs += ct
+        cost = (first_checks + (pairs - first_pairs)*(rank + plain))/pairs
+        if cost < best:
+            best = cost
+            likely = [each for each, _ct in ranked[:rank]]
+
+    overlap_window['likely'] = likely
+
+def reset_overlap_learning():
+    #each sample learns its own overlaps
+    overlap_window.update({'pairs':0, 'comparisons':0, 'match_size':{}, 'likely':None})
+
+def join_chunk(chunk):
+    '''
+    Joins a list of (read_id, f1_seq, f1_q, f2_seq, f2_q) pairs, returns the
+    joined reads tagged 'hit' (perfect join) or 'save' (slide join) together
+    with the overlap and cache tallies for this chunk only.
+    '''
+    start_time = time.time()
+
+    chunk_tally = {'match_size':{}, 'save_size':{}, 'rejected':{},
+                   'cache_hits':0, 'cache_misses':0, 'cache_evictions':0,
+                   'truncated':0, 'quality_filtered':0,
+                   'overlap_search':{'learning_pairs':0, 'learning_comparisons':0,
+                                     'adapted_pairs':0, 'adapted_comparisons':0}}
+    match_size = chunk_tally['match_size']
+    save_size = chunk_tally['save_size']
+    rejected = chunk_tally['rejected']
+    joined = []
+    unjoined = []
+    #pairs waiting for the slide search below, copies of them are filled in from the first
+    pending = {}
+    copies = []
+
+    f2_seqs = reverse_complement_batch([each[3] for each in chunk])
+    f2_qs = reverse_batch([each[4] for each in chunk])
+
+    for (read_id, f1_seq, f1_q, _f2_seq, _f2_q), f2_seq, f2_q in zip(chunk, f2_seqs, f2_qs):
+        if join_cache_size:
+            cache_key = (f1_seq, f2_seq)
+            cached = join_cache.get(cache_key)
+
+            if cached:
+                join_cache.move_to_end(cache_key)
+                chunk_tally['cache_hits'] += 1
+
+                join_type, index = cached
+                if join_type == 'hit':
+                    f3_seq, f3_q = build_join(f1_seq, f2_seq, f1_q, f2_q, index, match_size)
+                    joined.append((read_id, f3_seq, f3_q, 'hit'))
+                if join_type == 'save':
+                    f3_seq, f3_q = build_join(f1_seq, f2_seq, f1_q, f2_q, index, save_size)
+                    joined.append((read_id, f3_seq, f3_q, 'save'))
+                if join_type == None:
+                    #index holds the reject reason
+                    merge_tally(rejected, {index:1})
+                continue
+
+            if cache_key in pending:
+                chunk_tally['cache_hits'] += 1
+                copies.append((len(joined), read_id, f1_q, f2_q, pending[cache_key]))
+                joined.append(None)
+                continue
+
+            chunk_tally['cache_misses'] += 1
+
+        if adaptive_overlap:
+            index = adaptive_find_overlap(f1_seq, f2_seq, chunk_tally['overlap_search'])
+        else:
+            index = find_overlap(f1_seq, f2_seq, minimum_overlap)
+
+        if index:
+            f3_seq, f3_q = build_join(f1_seq, f2_seq, f1_q, f2_q, index, match_size)
+            joined.append((read_id, f3_seq, f3_q, 'hit'))
+
+            if join_cache_size:
+                cache_join(cache_key, ('hit', index), chunk_tally)
+
+        else:
+            #slide joins for the whole chunk are found at once below
+            if join_cache_size:
+                pending[cache_key] = len(unjoined)
+            unjoined.append((len(joined), read_id, f1_seq, f1_q, f2_seq, f2_q))
+            joined.append(None)
+
+    if unjoined:
+        indexes = slide_indexes([each[2] for each in unjoined], [each[4] for each in unjoined])
+        slide_joins = []
+
+        for (position, read_id, f1_seq, f1_q, f2_seq, f2_q), index in zip(unjoined, indexes):
+            f3_seq, f3_q = build_join(f1_seq, f2_seq, f1_q, f2_q, index, save_size)
+
+            if f3_seq != 0:
+                joined[position] = (read_id, f3_seq, f3_q, 'save')
+                cached = ('save', index)
+            else:
+                reason = reject_reason(f1_seq, f2_seq)
+                merge_tally(rejected, {reason:1})
+                cached = (None, reason)
+
+            slide_joins.append(cached)
+            if join_cache_size:
+                cache_join((f1_seq, f2_seq), cached, chunk_tally)
+
+        for position, read_id, f1_q, f2_q, first in copies:
+            _position, _read_id, f1_seq, _f1_q, f2_seq, _f2_q = unjoined[first]
+            join_type, index = slide_joins[first]
+
+            if join_type == 'save':
+                f3_seq, f3_q = build_join(f1_seq, f2_seq, f1_q, f2_q, index, save_size)
+                joined[position] = (read_id, f3_seq, f3_q, 'save')
+            else:
+                merge_tally(rejected, {index:1})
+
+        joined = [each for each in joined if each]
+
+    if adaptive_overlap and (overlap_window['likely'] is None):
+        learn_overlaps(match_size, chunk_tally['overlap_search'])
+
+    if merge_reads:
+        merges = merge_batch([each[1] for each in chunk], f2_seqs, [each[2] for each in chunk], f2_qs,
+                             merge_minimum_overlap, merge_maximum_diffs, merge_minimum_score)
+        #ahead of the joins, where the vsearch file used to be
+        joined = [(each[0], merged[0], merged[1], 'merge') for each, merged in zip(chunk, merges) if merged] + joined
+
+    if (truncate_quality is not None) or (max_ee is not None):
+        joined = quality_filter(joined, chunk_tally)
+
+    if qc_table:
+        #the joined reads are counted in write_joined, once the ones left out are known
+        chunk_tally['qc'] = {'R1': quality_columns([each[2] for each in chunk]),
+                             'R2': quality_columns([each[4] for each in chunk])}
+
+    chunk_tally['join_seconds'] = time.time() - start_time
+
+    return(joined, chunk_tally)
+
+def quality_filter(joined, chunk_tally):
+    #truncation then the expected error filter, see the v0.18 note
+    kept = []
+
+    for read_id, f3_seq, f3_q, join_type in joined:
+        if truncate_quality is not None:
+            position = truncate_position(f3_q, truncate_quality)
+
+            if position != -1:
+                chunk_tally['truncated'] += 1
+                f3_seq = f3_seq[:position]
+                f3_q = f3_q[:position]
+
+                if position < minimum_truncated_length:
+                    chunk_tally['quality_filtered'] += 1
+                    continue
+
+        if (max_ee is not None) and (expected_errors(f3_q) > max_ee):
+            chunk_tally['quality_filtered'] += 1
+            continue
+
+        kept.append((read_id, f3_seq, f3_q, join_type))
+
+    return(kept)
+
+def sweep_chunk(chunk):
+    '''
+    join_chunk for every (minimum_overlap, maximum_mismatch) in sweep_grid.
+    The longest exact overlap (from the smallest minimum_overlap up) and the
+    slide hit pattern of each pair are found once: a setting has a perfect
+    join wherever that overlap reaches its minimum_overlap, and otherwise
+    looks the hit pattern up in its own slide table. Returns a joined list
+    per setting, without the sequences unless sweep_outputs is set.
+    '''
+    start_time = time.time()
+
+    f1_seqs = [each[1] for each in chunk]
+    f2_seqs = reverse_complement_batch([each[3] for each in chunk])
+    f2_qs = reverse_batch([each[4] for each in chunk])
+
+    shortest = min(setting[0] for setting in sweep_grid)
+    overlaps = [find_overlap(f1_seq, f2_seq, shortest) for f1_seq, f2_seq in zip(f1_seqs, f2_seqs)]
+    hit_patterns = slide_hit_patterns(f1_seqs, f2_seqs)
+
+    tables = [slide_table((setting_overlap*2)-1, setting_mismatch) for setting_overlap, setting_mismatch in sweep_grid]
+    sweep_joined = [[] for setting in sweep_grid]
+
+    for (read_id, f1_seq, f1_q, _f2_seq, _f2_q), f2_seq, f2_q, overlap, hit_pattern in zip(chunk, f2_seqs, f2_qs, overlaps, hit_patterns):
+        for (setting_overlap, _setting_mismatch), table, joined in zip(sweep_grid, tables, sweep_joined):
+            if overlap and (overlap >= setting_overlap):
+                index = overlap
+                join_type = 'hit'
+            else:
+                index = table[hit_pattern]
+                if (index == -1) or ((len(f1_seq) + len(f2_seq) - index) < 250):
+                    continue
+                join_type = 'save'
+
+            if sweep_outputs:
+                joined.append((read_id, f1_seq + f2_seq[index:], f1_q + f2_q[index:], join_type))
+            else:
+                joined.append((read_id, None, None, join_type))
+
+    return(sweep_joined, time.time() - start_time)
+
+def chunk_pairs(pairs, size):
+    pairs = iter(pairs)
+    chunk = list(islice(pairs, size))
+    while chunk:
+        yield(chunk)
+        chunk = list(islice(pairs, size))
+
+def mark_chunks(chunks, tally, chunk_marks):
+    '''
+    Notes, as each chunk is read, how many R1/R2 records it takes to reach its
+    end and whether the reorder buffer was empty there (only then is it a safe
+    place to resume from).
+    '''
+    for chunk in chunks:
+        chunk_marks.append((tally['total_reads'], tally['reverse_reads'], (tally['pending'] == 0) and not tally['sort_runs']))
+        yield(chunk)
+
+def checkpoint_name(output_file):
+    return(log_prefix(output_file) + '.checkpoint')
+
+def record_index_name(output_file, read_tag):
+    #with the checkpoint, a .jidx in the raw read folder would be globbed as a read file
+    return(('{}_{}.jidx').format(log_prefix(output_file), read_tag))
+
+def checkpoint_settings(vsearch):
+    '''
+    The join_settings that change what a run writes, and the vsearch file.
+    A resume on top of a checkpoint made with any other values would mix
+    two kinds of output in one file. Round tripped through json so it
+    compares equal to what load_checkpoint reads back.
+    '''
+    settings = join_settings()
+    settings = {each: settings[each] for each in ['minimum_overlap', 'maximum_mismatch', 'slide_algorithm',
+                                                  'truncate_quality', 'minimum_truncated_length', 'max_ee', 'qc_table',
+                                                  'merge_reads', 'merge_minimum_overlap', 'merge_maximum_diffs',
+                                                  'merge_minimum_score', 'dereplicate']}
+    settings['vsearch'] = os.path.abspath(vsearch) if vsearch else None
+
+    return(json.loads(json.dumps(settings)))
+
+def write_checkpoint(output_file, fastq_1, fastq_2, vsearch, forward_records, reverse_records, output_bytes, tally):
+    checkpoint = {'fastq_1': os.path.abspath(fastq_1),
+                  'fastq_2': os.path.abspath(fastq_2),
+                  'forward_records': forward_records,
+                  'reverse_records': reverse_records,
+                  'output_bytes': output_bytes,
+                  'settings': checkpoint_settings(vsearch),
+                  'tally': tally}
+
+    #written aside and renamed, so a kill mid-write leaves the last checkpoint intact
+    temp_name = checkpoint_name(output_file) + '.tmp'
+    checkpoint_file = open(temp_name, 'w')
+    json.dump(checkpoint, checkpoint_file)
+    checkpoint_file.close()
+    os.replace(temp_name, checkpoint_name(output_file))
+
+def load_checkpoint(output_file, fastq_1, fastq_2, vsearch):
+    if not os.path.isfile(checkpoint_name(output_file)):
+        print('No checkpoint for {}, starting from the beginning'.format(output_file))
+        return(None)
+
+    checkpoint_file = open(checkpoint_name(output_file))
+    checkpoint = json.load(checkpoint_file)
+    checkpoint_file.close()
+
+    if (checkpoint['fastq_1'] != os.path.abspath(fastq_1)) or (checkpoint['fastq_2'] != os.path.abspath(fastq_2)):
+        sys.exit('Checkpoint {} is for different input files'.format(checkpoint_name(output_file)))
+
+    settings = checkpoint_settings(vsearch)
+    if checkpoint['settings'] != settings:
+        differences = ['{} {} (now {})'.format(each, checkpoint['settings'].get(each, 'unset'), settings.get(each, 'unset'))
+                       for each in sorted(set(settings) | set(checkpoint['settings']))
+                       if checkpoint['settings'].get(each, 'unset') != settings.get(each, 'unset')]
+        sys.exit('Checkpoint {} was made with {}'.format(checkpoint_name(output_file), ', '.join(differences)))
+
+    #json keys are strings, the overlap tallies are keyed by int
+    tally = checkpoint['tally']
+    for each in ['match_size', 'save_size']:
+        tally[each] = {int(index): ct for index, ct in tally[each].items()}
+
+    return(checkpoint)
+
+def join_chunks(chunks, threads, chunk_function=join_chunk):
+    '''
+    Runs join_chunk (or sweep_chunk) over the chunks and yields the results in
+    input order. At most two chunks per worker are in flight so memory stays
+    bounded.
+    '''
+    if threads <= 1:
+        for chunk in chunks:
+            yield(chunk_function(chunk))
+        return
+
+    pool = multiprocessing.Pool(threads, initializer=set_join_settings,
+                                initargs=(join_settings(),))
+    in_flight = deque()
+
+    for chunk in chunks:
+        in_flight.append(pool.apply_async(chunk_function, (chunk,)))
+        if len(in_flight) >= (threads*2):
+            yield(in_flight.popleft().get())
+
+    while in_flight:
+        yield(in_flight.popleft().get())
+
+    pool.close()
+    pool.join()
+
+def merge_tally(total_dict, chunk_dict):
+    for index, ct in chunk_dict.items():
+        if index not in total_dict:
+            total_dict[index] = 0
+
+        total_dict[index] += ct
+
+def merge_qc(total_qc, chunk_qc):
+    #adds up quality_columns per read type, position by position
+    for read_type, columns in chunk_qc.items():
+        if read_type not in total_qc:
+            total_qc[read_type] = {column: [] for column in columns}
+
+        for column, values in columns.items():
+            totals = total_qc[read_type][column]
+            if len(totals) < len(values):
+                totals.extend([0]*(len(values) - len(totals)))
+
+            for position, value in enumerate(values):
+                totals[position] += value
+
+def merge_chunk_tally(tally, chunk_tally):
+    for each, value in chunk_tally.items():
+        if each == 'qc':
+            merge_qc(tally[each], value)
+        elif isinstance(value, dict):
+            merge_tally(tally[each], value)
+        else:
+            tally[each] += value
+
+def write_joined(joined, v_index, tally, outfile, derep=None, qc=None):
+    '''
+    Counts one chunk of joined reads and writes them to outfile (if any) and
+    the dereplication table (if any). Perfect joins that vsearch (or --merge)
+    already joined are left out, saved joins are always kept. With qc the
+    quality columns of the reads kept are added to it as 'joined'.
+    '''
+    outlines = []
+    kept_quals = []
+
+    merged_ids = set()
+    if merge_reads:
+        merged_ids = {read_id for read_id, _f3_seq, _f3_q, join_type in joined if join_type == 'merge'}
+
+    for read_id, f3_seq, f3_q, join_type in joined:
         #if read_id =='@M01965:30:000000000-BMF6L:1:2114:15962:27429':
         #    1/0
-        f1_seq = fi_dict[read_id]['s']
-        f2_seq = fii_dict[read_id]['s']
-        f1_q = fi_dict[read_id]['q']
-        f2_q = fii_dict[read_id]['q']        
-        
-        f3_seq, f3_q = compare_two(f1_seq, f2_seq, f1_q, f2_q)
-        
-        if f3_seq != 0:
-            if (read_id not in v_set):
-                total_hit+=1
-                #read_id = read_id + ' 1:N:0:GGACTCCT+GCGTAAGA'
-                outline = ('{read_id}\n{f3_seq}\n+\n{f3_q}\n').format(read_id=read_id, f3_seq=f3_seq, f3_q =f3_q)
-                f3.write(outline)
-                
-            if (read_id in v_set):
-                vmatch_set.add(read_id)
-            
+        if join_type == 'merge':
+            tally['vsearch'] += 1
+            if outfile:
+                outlines.append(read_id + '\n' + f3_seq + '\n+\n' + f3_q + '\n')
+            if derep is not None:
+                add_derep(derep, read_id, f3_seq, f3_q)
+            if qc is not None:
+                kept_quals.append(f3_q)
+            continue
+
+        in_vsearch = (read_id in merged_ids) or ((tally['vsearch'] > 0) and in_id_index(v_index, read_id))
+
+        if in_vsearch:
+            tally['vsearch_overlap'] += 1
+
+        if (join_type == 'hit') and in_vsearch:
+            continue
+
+        if join_type == 'hit':
+            tally['total_hit']+=1
         else:
-            f3_seq, f3_q = slide_compare_two(f1_seq, f2_seq, f1_q, f2_q)
-            
-            if f3_seq != 0:
-                total_save+=1
-                #read_id = read_id + ' 1:N:0:GGACTCCT+GCGTAAGA'
-                outline = ('{read_id}\n{f3_seq}\n+\n{f3_q}\n').format(read_id=read_id, f3_seq=f3_seq, f3_q =f3_q)
-                f3.write(outline)
-                
-                if (read_id in v_set):
-                    vmatch_set.add(read_id)
+            tally['total_save']+=1
+
+        if outfile:
+            #read_id = read_id + ' 1:N:0:GGACTCCT+GCGTAAGA'
+            outlines.append(read_id + '\n' + f3_seq + '\n+\n' + f3_q + '\n')
+
+        if derep is not None:
+            add_derep(derep, read_id, f3_seq, f3_q)
+
+        if qc is not None:
+            kept_quals.append(f3_q)
+
+    if qc is not None:
+        merge_qc(qc, {'joined': quality_columns(kept_quals)})
+
+    if outlines:
+        #one write per chunk
+        outfile.write(''.join(outlines))
+
+def new_queue_counters(stage_queue):
+    return({'capacity': stage_queue.maxsize, 'items':0, 'depth_total':0, 'max_depth':0,
+            'put_stalls':0, 'get_stalls':0, 'put_wait':0, 'get_wait':0})
+
+def stage_put(stage_queue, item, counters):
+    #put that counts the queue depth and whether the producer had to wait
+    depth = stage_queue.qsize()
+    counters['items'] += 1
+    counters['depth_total'] += depth
+    counters['max_depth'] = max(counters['max_depth'], depth)
+
+    if stage_queue.full():
+        counters['put_stalls'] += 1
+
+    start = time.time()
+    stage_queue.put(item)
+    counters['put_wait'] += time.time() - start
+
+def stage_get(stage_queue, counters):
+    if stage_queue.empty():
+        counters['get_stalls'] += 1
+
+    start = time.time()
+    item = stage_queue.get()
+    counters['get_wait'] += time.time() - start
+
+    return(item)
+
+def queue_items(stage_queue, counters):
+    #yields what a stage put on stage_queue up to its None, re-raising its errors
+    item = stage_get(stage_queue, counters)
+    while item is not None:
+        if isinstance(item, BaseException):
+            raise item
+        yield(item)
+        item = stage_get(stage_queue, counters)
+
+def read_stage(chunks, read_queue, counters):
+    #reader thread, SystemExit included so a sync error still stops the run
+    try:
+        for chunk in chunks:
+            stage_put(read_queue, chunk, counters)
+        stage_put(read_queue, None, counters)
+    except BaseException as err:
+        read_queue.put(err)
+
+def write_stage(write_queue, counters, writing):
+    '''
+    Writer thread of run_join. writing holds the output, the tally and what
+    a checkpoint needs; the writer's own seconds and any error are put back
+    in it. After an error the queue is still drained so the joiner never
+    blocks on it.
+    '''
+    tally = writing['tally']
+    output_file = writing['output_file']
+
+    for joined, chunk_tally, (forward_records, reverse_records, in_sync) in queue_items(write_queue, counters):
+        if writing['error']:
+            continue
+
+        try:
+            write_start = time.time()
+            merge_chunk_tally(tally, chunk_tally)
+            write_joined(joined, writing['v_index'], tally, writing['writer'], writing['derep'], tally['qc'] if qc_table else None)
+
+            if checkpoint_interval and in_sync and (writing['derep'] is None) and ((time.time() - writing['last_checkpoint']) >= checkpoint_interval):
+                writing['writer'], output_bytes = commit_output(output_file, writing['raw'], writing['writer'])
+                #the counts as of this chunk, later chunks may already have been read
+                checkpoint_tally = dict(tally, total_reads=forward_records, reverse_reads=reverse_records, pending=0)
+                write_checkpoint(output_file, writing['fastq_1'], writing['fastq_2'], writing['vsearch'], forward_records, reverse_records, output_bytes, checkpoint_tally)
+                writing['last_checkpoint'] = time.time()
+
+            writing['write_seconds'] += time.time() - write_start
+
+        except Exception as err:
+            writing['error'] = err
+
+def new_tally():
+    return({'total_reads':0, 'reverse_reads':0, 'pending':0, 'sort_runs':0, 'vsearch':0,
+            'total_hit':0, 'total_save':0, 'vsearch_overlap':0,
+            'match_size':{}, 'save_size':{}, 'rejected':{},
+            'cache_hits':0, 'cache_misses':0, 'cache_evictions':0, 'join_seconds':0,
+            'truncated':0, 'quality_filtered':0, 'qc':{}, 'derep_reads':0, 'derep_unique':0,
+            'overlap_search':{}})
+
+def run_join(fastq_1, fastq_2, vsearch, output_file, threads):
+    '''
+    Joins one sample and writes its joined reads and .log, returns the tally
+    of read counts and overlap sizes.
+    '''
+    tally = new_tally()
+    stage_seconds = {}
+    start_time = time.time()
+    reset_overlap_learning()
+
+    checkpoint = None
+    if resume:
+        checkpoint = load_checkpoint(output_file, fastq_1, fastq_2, vsearch)
+
+    if checkpoint:
+        tally = checkpoint['tally']
+        f1 = open_fastq_at(fastq_1, checkpoint['forward_records'], record_index_name(output_file, 'R1'))
+        f2 = open_fastq_at(fastq_2, checkpoint['reverse_records'], record_index_name(output_file, 'R2'))
+        f3_raw, f3 = open_output(output_file, checkpoint['output_bytes'])
+        print('Resuming {} from read {}'.format(output_file, checkpoint['forward_records']))
+    else:
+        f1 = open_fastq(fastq_1)
+        f2 = open_fastq(fastq_2)
+        f3_raw, f3 = None, None
+        if dereplicate != 'instead':
+            f3_raw, f3 = open_output(output_file)
+
+    f_log = open(log_prefix(output_file) + '.log','w')
+
+    derep = None
+    if dereplicate:
+        derep = {}
+
+    v_index = build_id_index([])
+
+    if vsearch:
+        v1 = open_fastq(vsearch)
+        if checkpoint:
+            #already copied before the checkpoint, only the IDs are needed
+            v_ids = copy_vsearch(v1, None)
+        else:
+            v_ids = copy_vsearch(v1, f3, derep)
+        v_index = build_id_index(v_ids)
+        tally['vsearch'] = sum(len(bucket) for bucket in v_index)
+        v1.close()
+
+    stage_seconds['vsearch'] = time.time() - start_time
+    join_start = time.time()
+    chunk_marks = deque()
+
+    chunks = chunk_pairs(pair_reads(read_fastq(f1), read_fastq(f2), tally), chunk_size)
+    chunks = mark_chunks(chunks, tally, chunk_marks)
+
+    read_queue = queue.Queue(maxsize=queue_depth)
+    write_queue = queue.Queue(maxsize=queue_depth)
+    pipeline = {'read_queue': new_queue_counters(read_queue),
+                'write_queue': new_queue_counters(write_queue)}
+    writing = {'output_file': output_file, 'raw': f3_raw, 'writer': f3,
+               'fastq_1': fastq_1, 'fastq_2': fastq_2, 'vsearch': vsearch, 'v_index': v_index,
+               'tally': tally, 'last_checkpoint': time.time(),
+               'derep': derep, 'write_seconds': 0, 'error': None}
+
+    reader = threading.Thread(target=read_stage, args=(chunks, read_queue, pipeline['read_queue']), daemon=True)
+    writer = threading.Thread(target=write_stage, args=(write_queue, pipeline['write_queue'], writing), daemon=True)
+    reader.start()
+    writer.start()
+
+    for joined, chunk_tally in join_chunks(queue_items(read_queue, pipeline['read_queue']), threads):
+        if writing['error']:
+            break
+        stage_put(write_queue, (joined, chunk_tally, chunk_marks.popleft()), pipeline['write_queue'])
+
+    stage_put(write_queue, None, pipeline['write_queue'])
+    writer.join()
+
+    if writing['error']:
+        raise writing['error']
+
+    f1.close()
+    f2.close()
+    if f3_raw:
+        close_output(f3_raw, writing['writer'])
+
+    if dereplicate:
+        if dereplicate == 'instead':
+            write_derep(output_file, derep)
+        else:
+            write_derep(suffixed_output_name(output_file, '_derep'), derep)
+
+        tally['derep_unique'] = len(derep)
+        tally['derep_reads'] = sum(entry[0] for entry in derep.values())
+        derep.clear()
+
+    for each in [checkpoint_name(output_file), record_index_name(output_file, 'R1'), record_index_name(output_file, 'R2')]:
+        if os.path.isfile(each):
+            os.remove(each)
+
+    stage_seconds['join_and_write'] = time.time() - join_start
+    stage_seconds['join_workers'] = tally['join_seconds']
+    stage_seconds['write'] = writing['write_seconds']
+    stage_seconds['total'] = time.time() - start_time
+
+    write_report(log_prefix(output_file) + '.json', tally, stage_seconds, threads, pipeline)
+
+    if qc_table:
+        write_qc_table(log_prefix(output_file) + '.qc', tally['qc'])
+
+    total_reads = tally['total_reads']
+
+    if merge_reads:
+        vsearch_label = 'Total Quality-aware Merge'
+    else:
+        vsearch_label = 'Total import from Vsearch'
+
+    outline = ('\tTotal Reads:\t{total}\n\t{label}:\t{vsearch}\t({frac}%)\n').format(total = total_reads, label = vsearch_label, vsearch = tally['vsearch'], frac = tally['vsearch']/total_reads)
+    print(outline)
+    f_log.write(outline)
+
+    outline = ('\tTotal Perfect Join Match:\t{join}\t({frac}%)\n').format(join = tally['total_hit'], frac = tally['total_hit']/total_reads)
+    print(outline)
+    f_log.write(outline)
+
+    outline = ('\tTotal Saved Join:\t{save}\t({frac}%)\n').format(save = tally['total_save'], frac = tally['total_save']/total_reads)
+    print(outline)
+    f_log.write(outline)
+
+    outline = ('\tTotal Vsearch Overlap:\t{overlap}\t({frac}%)\n').format(overlap = tally['vsearch_overlap'], frac = tally['vsearch_overlap']/total_reads)
+    print(outline)
+    f_log.write(outline)
+
+    if join_cache_size:
+        lookups = max(tally['cache_hits'] + tally['cache_misses'], 1)
+        outline = ('\tJoin Cache Hits:\t{hits}\t({frac}%)\n\tJoin Cache Evictions:\t{evictions}\n').format(hits = tally['cache_hits'], frac = tally['cache_hits']/lookups, evictions = tally['cache_evictions'])
+        print(outline)
+        f_log.write(outline)
+
+    if adaptive_overlap:
+        overlap_search = tally['overlap_search']
+        outline = ('\tOverlap Comparisons per Pair:\t{learning} learning ({learning_pairs} pairs)\t{adapted} adapted ({adapted_pairs} pairs)\n').format(
+            learning = round(overlap_search.get('learning_comparisons', 0)/max(overlap_search.get('learning_pairs', 0), 1), 3),
+            learning_pairs = overlap_search.get('learning_pairs', 0),
+            adapted = round(overlap_search.get('adapted_comparisons', 0)/max(overlap_search.get('adapted_pairs', 0), 1), 3),
+            adapted_pairs = overlap_search.get('adapted_pairs', 0))
+        print(outline)
+        f_log.write(outline)
+
+    if (truncate_quality is not None) or (max_ee is not None):
+        outline = ('\tTotal Truncated:\t{truncated}\n\tTotal Quality Filtered:\t{filtered}\t({frac}%)\n').format(truncated = tally['truncated'], filtered = tally['quality_filtered'], frac = tally['quality_filtered']/total_reads)
+        print(outline)
+        f_log.write(outline)
+
+    if dereplicate:
+        outline = ('\tTotal Unique Sequences:\t{unique}\t({ratio} reads per unique)\n').format(unique = tally['derep_unique'], ratio = round(tally['derep_reads']/max(tally['derep_unique'], 1), 2))
+        print(outline)
+        f_log.write(outline)
+
+    f_log.close()
+
+    return(tally)
+
+def write_qc_table(qc_file_name, qc):
+    qc_file = open(qc_file_name, 'w')
+    qc_file.write('read\tposition\treads\tmean_quality\tbelow_q20\tq30\n')
+
+    for read_type in ['R1', 'R2', 'joined']:
+        if read_type not in qc:
+            continue
+
+        columns = qc[read_type]
+        for position, reads in enumerate(columns['reads']):
+            if not reads:
+                continue
+
+            outline = ('{}\t{}\t{}\t{}\t{}\t{}\n').format(read_type, position + 1, reads,
+                                                           round(columns['quality'][position]/reads, 2),
+                                                           round(columns['below_q20'][position]/reads, 4),
+                                                           round(columns['q30'][position]/reads, 4))
+            qc_file.write(outline)
+
+    qc_file.close()
+
+def write_report(report_file_name, tally, stage_seconds, threads, pipeline=None):
+    '''
+    Machine readable companion to the .log, see the v0.12 note. join_workers
+    is summed over all worker processes so it can exceed the wall time.
+    pipeline holds the queue counters of run_join (v0.17 note).
+    '''
+    pairs = tally['total_reads']
+
+    stages = {}
+    for stage, seconds in stage_seconds.items():
+        stages[stage] = {'seconds': round(seconds, 3),
+                         'pairs_per_second': round(pairs/seconds, 1) if seconds else None}
+
+    peak_rss = {}
+    if resource:
+        #kilobytes on Linux
+        peak_rss['self_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_rss['children_kb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    report = {'settings': join_settings(),
+              'threads': threads,
+              'stages': stages,
+              'peak_rss': peak_rss,
+              'reads': {'total_reads': pairs,
+                        'vsearch': tally['vsearch'],
+                        'perfect_join': tally['total_hit'],
+                        'saved_join': tally['total_save'],
+                        'vsearch_overlap': tally['vsearch_overlap']},
+              'sort_runs': tally['sort_runs'],
+              'rejected': tally['rejected'],
+              'match_size': {str(index): tally['match_size'][index] for index in sorted(tally['match_size'])},
+              'save_size': {str(index): tally['save_size'][index] for index in sorted(tally['save_size'])},
+              'dereplication': {'reads': tally['derep_reads'],
+                                'unique': tally['derep_unique']},
+              'overlap_search': tally['overlap_search'],
+              'quality_filter': {'truncated': tally['truncated'],
+                                 'filtered': tally['quality_filtered']},
+              'join_cache': {'hits': tally['cache_hits'],
+                             'misses': tally['cache_misses'],
+                             'evictions': tally['cache_evictions']}}
+
+    if pipeline:
+        report['pipeline'] = {}
+        for stage_queue, counters in pipeline.items():
+            report['pipeline'][stage_queue] = {'capacity': counters['capacity'],
+                                               'chunks': counters['items'],
+                                               'mean_depth': round(counters['depth_total']/max(counters['items'], 1), 2),
+                                               'max_depth': counters['max_depth'],
+                                               'put_stalls': counters['put_stalls'],
+                                               'get_stalls': counters['get_stalls'],
+                                               'put_wait_seconds': round(counters['put_wait'], 3),
+                                               'get_wait_seconds': round(counters['get_wait'], 3)}
+
+    report_file = open(report_file_name, 'w')
+    json.dump(report, report_file, indent=1)
+    report_file.close()
+
+def sample_pairs(pairs, sample_size, seed=1):
+    '''
+    Uniform reservoir sample of sample_size pairs in one pass. Uses Li's
+    Algorithm L, which draws how many pairs to skip before the next
+    replacement, so most pairs cost a single comparison.
+    '''
+    rng = random.Random(seed)
+    reservoir = []
+    if sample_size <= 0:
+        #still read to the end, so the lane is counted
+        for _pair in pairs:
+            pass
+        return(reservoir)
+
+    weight = math.exp(math.log(rng.random())/sample_size)
+    next_pick = sample_size + int(math.log(rng.random())/math.log(1 - weight))
+
+    for ct, pair in enumerate(pairs):
+        if ct < sample_size:
+            reservoir.append(pair)
+
+        elif ct == next_pick:
+            reservoir[rng.randrange(sample_size)] = pair
+            weight *= math.exp(math.log(rng.random())/sample_size)
+            next_pick += int(math.log(rng.random())/math.log(1 - weight)) + 1
+
+    return(reservoir)
+
+def wilson_interval(hits, total, z=1.96):
+    #95% confidence interval of a proportion, sane near 0 and 1 and for small samples
+    if not total:
+        return(0, 0)
+
+    frac = hits/total
+    denominator = 1 + z*z/total
+    centre = (frac + z*z/(2*total))/denominator
+    half_width = z*math.sqrt(frac*(1 - frac)/total + z*z/(4*total*total))/denominator
+
+    return(max(0, centre - half_width), min(1, centre + half_width))
+
+def run_estimate(fastq_1, fastq_2, vsearch, sample_size, output_file):
+    '''
+    Dry run, see the v0.14 note. The whole lane is still read, to count it
+    and draw the sample, but only the sampled pairs are joined.
+    '''
+    tally = new_tally()
+    start_time = time.time()
+
+    v_index = build_id_index([])
+    if vsearch:
+        v1 = open_fastq(vsearch)
+        v_index = build_id_index(copy_vsearch(v1, None))
+        tally['vsearch'] = sum(len(bucket) for bucket in v_index)
+        v1.close()
+
+    f1 = open_fastq(fastq_1)
+    f2 = open_fastq(fastq_2)
+    sample = sample_pairs(pair_reads(read_fastq(f1), read_fastq(f2), tally), sample_size)
+    f1.close()
+    f2.close()
+
+    sample_tally = new_tally()
+    sample_tally['vsearch'] = tally['vsearch']
+    for joined, chunk_tally in join_chunks(chunk_pairs(sample, chunk_size), threads):
+        merge_chunk_tally(sample_tally, chunk_tally)
+        write_joined(joined, v_index, sample_tally, None)
+
+    total_reads = tally['total_reads']
+    sampled = len(sample)
+
+    outlines = [('\tTotal Reads:\t{}\n\tSampled Pairs:\t{}\n\tTotal import from Vsearch:\t{}\n').format(total_reads, sampled, tally['vsearch']),
+                ('\tEstimate\tfraction\tlow_95\thigh_95\treads\treads_low_95\treads_high_95\n')]
+
+    estimates = [('Perfect Join Match', 'total_hit'), ('Saved Join', 'total_save'), ('Vsearch Overlap', 'vsearch_overlap')]
+    if merge_reads:
+        estimates.insert(0, ('Quality-aware Merge', 'vsearch'))
+        sample_tally['vsearch'] -= tally['vsearch']
+
+    for name, each in estimates:
+        low, high = wilson_interval(sample_tally[each], sampled)
+        frac = sample_tally[each]/max(sampled, 1)
+        outlines.append(('\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n').format(name, round(frac, 5), round(low, 5), round(high, 5),
+                                                               round(frac*total_reads), round(low*total_reads), round(high*total_reads)))
+
+    outlines.append('\tOverlap\tperfect_join\tsaved_join\n')
+    for index in sorted(set(sample_tally['match_size']) | set(sample_tally['save_size'])):
+        outlines.append(('\t{}\t{}\t{}\n').format(index, sample_tally['match_size'].get(index, 0), sample_tally['save_size'].get(index, 0)))
+
+    outlines.append(('\tEstimated in {} seconds\n').format(round(time.time() - start_time, 1)))
+
+    print(''.join(outlines))
+
+    if output_file:
+        estimate_file = open(log_prefix(output_file) + '.estimate','w')
+        estimate_file.write(''.join(outlines))
+        estimate_file.close()
+
+    return(sample_tally)
+
+def suffixed_output_name(output_file, suffix):
+    #output file name with suffix added before its extensions
+    prefix = log_prefix(output_file)
+    return(prefix + suffix + output_file[len(prefix):])
+
+def sweep_output_name(output_file, setting_overlap, setting_mismatch):
+    return(suffixed_output_name(output_file, ('_min{}_err{}').format(setting_overlap, setting_mismatch)))
+
+def run_sweep(fastq_1, fastq_2, vsearch, output_file, threads):
+    '''
+    Parameter sweep, see the v0.15 note. Returns the tally of each setting in
+    sweep_grid order.
+    '''
+    tally = new_tally()
+    start_time = time.time()
+
+    v_index = build_id_index([])
+    if vsearch:
+        v1 = open_fastq(vsearch)
+        v_index = build_id_index(copy_vsearch(v1, None))
+        tally['vsearch'] = sum(len(bucket) for bucket in v_index)
+        v1.close()
+
+    setting_tallies = []
+    outputs = []
+    for setting_overlap, setting_mismatch in sweep_grid:
+        setting_tally = new_tally()
+        setting_tally['vsearch'] = tally['vsearch']
+        setting_tallies.append(setting_tally)
+
+        if sweep_outputs:
+            f3_raw, f3 = open_output(sweep_output_name(output_file, setting_overlap, setting_mismatch))
+            if vsearch:
+                v1 = open_fastq(vsearch)
+                for line in v1:
+                    f3.write(line)
+                v1.close()
+            outputs.append((f3_raw, f3))
+        else:
+            outputs.append((None, None))
+
+    f1 = open_fastq(fastq_1)
+    f2 = open_fastq(fastq_2)
+    chunks = chunk_pairs(pair_reads(read_fastq(f1), read_fastq(f2), tally), chunk_size)
+
+    for sweep_joined, join_seconds in join_chunks(chunks, threads, sweep_chunk):
+        tally['join_seconds'] += join_seconds
+        for joined, setting_tally, (f3_raw, f3) in zip(sweep_joined, setting_tallies, outputs):
+            write_joined(joined, v_index, setting_tally, f3)
+
+    f1.close()
+    f2.close()
+    for f3_raw, f3 in outputs:
+        if f3:
+            close_output(f3_raw, f3)
+
+    total_reads = tally['total_reads']
+
+    outlines = [('minimum_overlap\tmaximum_mismatch\ttotal_reads\tvsearch\tperfect_join\tsaved_join\tvsearch_overlap\tjoined_fraction\n')]
+    for (setting_overlap, setting_mismatch), setting_tally in zip(sweep_grid, setting_tallies):
+        joined_frac = (tally['vsearch'] + setting_tally['total_hit'] + setting_tally['total_save'] - setting_tally['vsearch_overlap'])/max(total_reads, 1)
+        outlines.append(('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n').format(setting_overlap, setting_mismatch, total_reads, tally['vsearch'],
+                        setting_tally['total_hit'], setting_tally['total_save'], setting_tally['vsearch_overlap'], round(joined_frac, 5)))
+
+    print(''.join(outlines))
+    print(('Swept {} settings over {} pairs in {} seconds').format(len(sweep_grid), total_reads, round(time.time() - start_time, 1)))
+
+    if output_file:
+        sweep_file = open(log_prefix(output_file) + '.sweep','w')
+        sweep_file.write(''.join(outlines))
+        sweep_file.close()
+
+    for setting_tally in setting_tallies:
+        setting_tally['total_reads'] = total_reads
+
+    return(setting_tallies)
+
+def find_sample_file(folder, sample, read_tag):
+    #the sample's *_R1_001.fastq[.gz] (or R2) anywhere under folder, nothing else that starts that way
+    found = []
+    for extension in ['.fastq', '.fastq.gz']:
+        pattern = os.path.join(folder, '**', '{}_*{}_001{}'.format(sample, read_tag, extension))
+        found.extend(glob.glob(pattern, recursive=True))
+    found = sorted(found)
+
+    if len(found) != 1:
+        outline = ('Expected one {} file for sample {} under {}, found {}').format(read_tag, sample, folder, len(found))
+        sys.exit(outline)
+
+    return(found[0])
+
+def parse_mapping_file(mapping_file_name):
+    #sample-ids from the first column of the Qiime mapping file
+    samples = []
+
+    mapping_file = open(mapping_file_name)
+    for line in mapping_file:
+        if line.strip() and line[0] != '#' and not line.startswith('sample-id'):
+            samples.append(line.split('\t')[0].strip())
+    mapping_file.close()
+
+    return(samples)
+
+def casava_name(sample, sample_number):
+    #Casava 1.8 file name, qiime takes the sample-id from what is before _S<n>_L001
+    return(('{}_S{}_L001_R1_001.fastq.gz').format(sample, sample_number))
+
+def write_casava_manifest(casava_folder, samples):
+    #the MANIFEST and metadata.yml qiime expects next to the per sample files
+    manifest = open(os.path.join(casava_folder, 'MANIFEST'), 'w')
+    manifest.write('sample-id,filename,direction\n')
+    for sample_number, sample in enumerate(samples, 1):
+        manifest.write(('{},{},forward\n').format(sample, casava_name(sample, sample_number)))
+    manifest.close()
+
+    metadata = open(os.path.join(casava_folder, 'metadata.yml'), 'w')
+    metadata.write('{phred-offset: 33}\n')
+    metadata.close()
+
+def run_sample(sample, fastq_folder, vsearch_folder, joined_folder, sample_threads, casava_folder=None, sample_number=None):
+    fastq_1 = find_sample_file(fastq_folder, sample, 'R1')
+    fastq_2 = find_sample_file(fastq_folder, sample, 'R2')
+
+    vsearch = None
+    if vsearch_folder:
+        vsearch = find_sample_file(vsearch_folder, sample, 'R1')
+
+    if casava_folder:
+        output_file = os.path.join(casava_folder, casava_name(sample, sample_number))
+    else:
+        output_file = os.path.join(joined_folder, os.path.basename(fastq_1))
+
+    print('Starting on {}...'.format(sample))
+    tally = run_join(fastq_1, fastq_2, vsearch, output_file, sample_threads)
+
+    if casava_folder:
+        #the .log, .json and the like would not pass qiime's check of the folder
+        for side_file in glob.glob(glob.escape(log_prefix(output_file)) + '*'):
+            if side_file != output_file:
+                shutil.move(side_file, os.path.join(joined_folder, os.path.basename(side_file)))
+
+    print('Completed {}. Saved to {}'.format(sample, output_file))
+
+    return(tally)
+
+def run_mapping_file(mapping_file_name, fastq_folder, vsearch_folder, joined_folder, threads, casava_folder=None):
+    '''
+    Joins every sample in the mapping file. Up to --threads samples run at
+    once, each in its own process, and any threads left over are shared out
+    to the samples' own join pools. With casava_folder the joined reads go
+    there in the layout qiime imports.
+    '''
+    samples = parse_mapping_file(mapping_file_name)
+
+    if casava_folder:
+        os.makedirs(casava_folder, exist_ok=True)
+        write_casava_manifest(casava_folder, samples)
+
+    concurrent_samples = max(1, min(threads, len(samples)))
+    sample_threads = max(1, threads // concurrent_samples)
+
+    tallies = {}
+    with concurrent.futures.ProcessPoolExecutor(concurrent_samples, initializer=set_join_settings,
+                                                initargs=(join_settings(),)) as executor:
+        futures = {}
+        for sample_number, sample in enumerate(samples, 1):
+            futures[sample] = executor.submit(run_sample, sample, fastq_folder, vsearch_folder,
+                                              joined_folder, sample_threads, casava_folder, sample_number)
+        for sample in samples:
+            tallies[sample] = futures[sample].result()
+
+    summary_file = open(os.path.join(joined_folder, 'juntar_summary.log'), 'w')
+    header = ('sample\ttotal_reads\tvsearch\tperfect_join\tsaved_join\tvsearch_overlap\n')
+    summary_file.write(header)
+
+    totals = {'total_reads':0, 'vsearch':0, 'total_hit':0, 'total_save':0, 'vsearch_overlap':0}
+    for sample in samples + ['total']:
+        if sample == 'total':
+            tally = totals
+        else:
+            tally = tallies[sample]
+            for each in totals:
+                totals[each] += tally[each]
+
+        outline = ('{}\t{}\t{}\t{}\t{}\t{}\n').format(sample, tally['total_reads'], tally['vsearch'], tally['total_hit'], tally['total_save'], tally['vsearch_overlap'])
+        summary_file.write(outline)
+
+    summary_file.close()
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    if args.minimum_overlap:
+        minimum_overlap = int(args.minimum_overlap)
+
+    if args.maximum_mismatch:
+        maximum_mismatch = int(args.maximum_mismatch)
+
+    if args.slide_algorithm:
+        slide_algorithm = args.slide_algorithm
+
+    if args.reorder_buffer:
+        reorder_buffer = int(args.reorder_buffer)
+
+    if args.pairing:
+        pairing = args.pairing
+
+    if args.sort_run_size:
+        sort_run_size = int(args.sort_run_size)
+
+    if args.temp_folder:
+        temp_folder = args.temp_folder
+
+    if args.threads:
+        threads = int(args.threads)
+
+    if args.compress_level:
+        compress_level = int(args.compress_level)
+
+    if args.compress_threads:
+        compress_threads = max(1, int(args.compress_threads))
+
+    if args.chunk_size:
+        chunk_size = int(args.chunk_size)
+
+    if args.join_cache:
+        join_cache_size = int(args.join_cache)
+
+    if args.adaptive_overlap:
+        adaptive_overlap = int(args.adaptive_overlap)
+
+    if args.truncate_quality:
+        truncate_quality = int(args.truncate_quality)
+
+    if args.minimum_truncated_length:
+        minimum_truncated_length = int(args.minimum_truncated_length)
+
+    if args.max_ee:
+        max_ee = float(args.max_ee)
+
+    if args.qc_table:
+        qc_table = True
+
+    if args.merge:
+        merge_reads = True
+
+    if args.merge_minimum_overlap:
+        merge_minimum_overlap = int(args.merge_minimum_overlap)
+
+    if args.merge_maximum_diffs:
+        merge_maximum_diffs = int(args.merge_maximum_diffs)
+
+    if args.merge_minimum_score:
+        merge_minimum_score = float(args.merge_minimum_score)
+
+    if args.dereplicate:
+        dereplicate = args.dereplicate
+
+    if args.queue_depth:
+        queue_depth = max(1, int(args.queue_depth))
+
+    if args.checkpoint_interval:
+        checkpoint_interval = float(args.checkpoint_interval)
+
+    if args.resume:
+        resume = True
 
-f3.close()
+    if args.sweep_outputs:
+        sweep_outputs = True
 
-outline = ('\tTotal Reads:\t{total}\n\tTotal import from Vsearch:\t{vsearch}\t({frac}%)\n').format(total = len(fi_dict), vsearch = len(v_set), frac = len(v_set)/len(fi_dict))
-print(outline)
-f_log.write(outline)
+    if args.sweep_overlap or args.sweep_mismatch:
+        sweep_overlaps = [minimum_overlap]
+        if args.sweep_overlap:
+            sweep_overlaps = [int(each) for each in args.sweep_overlap.split(',')]
 
-outline = ('\tTotal Perfect Join Match:\t{join}\t({frac}%)\n').format(join = total_hit, frac = total_hit/len(fi_dict))
-print(outline)
-f_log.write(outline)
+        sweep_mismatches = [maximum_mismatch]
+        if args.sweep_mismatch:
+            sweep_mismatches = [int(each) for each in args.sweep_mismatch.split(',')]
 
-outline = ('\tTotal Saved Join:\t{save}\t({frac}%)\n').format(save = total_save, frac = total_save/len(fi_dict))
-print(outline)
-f_log.write(outline)
+        sweep_grid = [(setting_overlap, setting_mismatch) for setting_overlap in sweep_overlaps for setting_mismatch in sweep_mismatches]
 
-f_log.close()
+    if sweep_grid:
+        run_sweep(args.fastq_1, args.fastq_2, args.vsearch, args.output_file, threads)
+    elif args.estimate:
+        if int(args.estimate) <= 0:
+            sys.exit('--estimate needs a number of pairs above 0, not {}'.format(args.estimate))
+        run_estimate(args.fastq_1, args.fastq_2, args.vsearch, int(args.estimate), args.output_file)
+    elif args.mapping_file:
+        run_mapping_file(args.mapping_file, args.fastq_folder, args.vsearch_folder, args.joined_folder, threads, args.casava_folder)
+    else:
+        run_join(args.fastq_1, args.fastq_2, args.vsearch, args.output_file, threads)
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+juntar_benchmark.py
+
+Throughput benchmark for juntar.py on seeded synthetic MiSeq-like paired reads.
+
+For every size in --pairs a lane is generated in --work_folder, joined end to
+end by running juntar.py, and reverse_compliment, compare_two and
+slide_compare_two are timed on the same pairs. Pairs per second and peak
+memory are reported per size, the latter as two columns: the peak RSS of the
+juntar.py process itself and that of its largest worker (RUSAGE_CHILDREN
+gives the largest single child, so neither is the run's concurrent total).
+The sha256 of each joined output is checked against --baseline_file so a
+speedup cannot silently change the joins, use --save_baseline to (re)record
+it.
+
+Standard usage:
+    python juntar_benchmark.py --work_folder /scratch/juntar_bench \
+        --pairs 10000,1000000,10000000 \
+        --baseline_file juntar_baseline.json \
+        --output_file juntar_benchmark.tab
+
+Synthetic lane settings:
+    --read_length       bases per read (250)
+    --amplicon_min/max  amplicon length range (380-500), with 250 bp reads
+                        this gives overlaps of 0-120 bp
+    --error_rate        per base substitution rate (0.005)
+    --n_rate            per base rate of N calls (0.001)
+    --duplication_rate  fraction of pairs that are byte-identical copies of an
+                        earlier pair (0.5)
+    --vsearch_fraction  fraction of pairs also written to the vsearch file (0.3)
+    --seed              random seed (1)
+
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import juntar
+from juntar_kernels import iupac_complement
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-w',"--work_folder")
+parser.add_argument('-p',"--pairs")
+parser.add_argument('-b',"--baseline_file")
+parser.add_argument('-save',"--save_baseline", action='store_true')
+parser.add_argument('-o',"--output_file")
+parser.add_argument('-t',"--threads")
+
+parser.add_argument('-len',"--read_length")
+parser.add_argument('-amin',"--amplicon_min")
+parser.add_argument('-amax',"--amplicon_max")
+parser.add_argument('-e',"--error_rate")
+parser.add_argument('-n',"--n_rate")
+parser.add_argument('-dup',"--duplication_rate")
+parser.add_argument('-vf',"--vsearch_fraction")
+parser.add_argument('-s',"--seed")
+
+def make_quality(rng, read_length):
+    #MiSeq-like, high early in the read and tailing off towards the end
+    quality = []
+    for position in range(read_length):
+        top = 40 - (12*position)//read_length
+        quality.append(chr(33 + rng.randint(top - 8, top)))
+    return(''.join(quality))
+
+def add_errors(rng, seq, error_rate, n_rate):
+    if not (error_rate or n_rate):
+        return(seq)
+
+    seq = list(seq)
+    for position in range(len(seq)):
+        roll = rng.random()
+        if roll < n_rate:
+            seq[position] = 'N'
+        elif roll < (n_rate + error_rate):
+            seq[position] = rng.choice('ACGT'.replace(seq[position], ''))
+    return(''.join(seq))
+
+def generate_lane(prefix, pairs, settings):
+    '''
+    Writes prefix_R1.fastq, prefix_R2.fastq and prefix_vsearch.fastq. Every
+    pair is cut from an amplicon with the length drawn from amplicon_min -
+    amplicon_max, R2 being the reverse complement of the amplicon's end.
+    '''
+    rng = random.Random(settings['seed'])
+    read_length = settings['read_length']
+
+    f1 = open(prefix + '_R1.fastq', 'w')
+    f2 = open(prefix + '_R2.fastq', 'w')
+    fv = open(prefix + '_vsearch.fastq', 'w')
+
+    previous = []
+
+    for pair_ct in range(pairs):
+        if previous and (rng.random() < settings['duplication_rate']):
+            amplicon, r1_seq, r1_q, r2_seq, r2_q = rng.choice(previous)
+        else:
+            amplicon_length = rng.randint(settings['amplicon_min'], settings['amplicon_max'])
+            amplicon = ''.join(rng.choice('ACGT') for _base in range(amplicon_length))
+
+            r1_seq = add_errors(rng, amplicon[:read_length], settings['error_rate'], settings['n_rate'])
+            r2_seq = add_errors(rng, amplicon.translate(iupac_complement)[::-1][:read_length], settings['error_rate'], settings['n_rate'])
+            r1_q = make_quality(rng, len(r1_seq))
+            r2_q = make_quality(rng, len(r2_seq))
+
+            #a bounded pool of earlier pairs to duplicate from
+            if len(previous) < 10000:
+                previous.append((amplicon, r1_seq, r1_q, r2_seq, r2_q))
+            else:
+                previous[rng.randrange(10000)] = (amplicon, r1_seq, r1_q, r2_seq, r2_q)
+
+        read_id = ('@M00000:1:000000000-SYNTH:1:{}:{}:{}').format(1101 + pair_ct//1000000, pair_ct % 1000000, pair_ct % 997)
+
+        f1.write(('{} 1:N:0:1\n{}\n+\n{}\n').format(read_id, r1_seq, r1_q))
+        f2.write(('{} 2:N:0:1\n{}\n+\n{}\n').format(read_id, r2_seq, r2_q))
+
+        if rng.random() < settings['vsearch_fraction']:
+            fv.write(('{} 1:N:0:1\n{}\n+\n{}\n').format(read_id, amplicon, 'I'*len(amplicon)))
+
+    f1.close()
+    f2.close()
+    fv.close()
+
+def time_kernels(prefix, chunk_size=10000):
+    '''
+    Times reverse_compliment, compare_two and slide_compare_two over every
+    pair of the lane, a chunk at a time so memory stays flat at any size.
+    '''
+    seconds = {'reverse_compliment':0, 'compare_two':0, 'slide_compare_two':0}
+    match_size = {}
+    save_size = {}
+
+    f1 = open(prefix + '_R1.fastq')
+    f2 = open(prefix + '_R2.fastq')
+
+    tally = juntar.new_tally()
+    chunks = juntar.chunk_pairs(juntar.pair_reads(juntar.read_fastq(f1), juntar.read_fastq(f2), tally), chunk_size)
+
+    for chunk in chunks:
+        start = time.perf_counter()
+        f2_seqs = [juntar.reverse_compliment(each[3]) for each in chunk]
+        seconds['reverse_compliment'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for each, f2_seq in zip(chunk, f2_seqs):
+            juntar.compare_two(each[1], f2_seq, each[2], each[4], match_size)
+        seconds['compare_two'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for each, f2_seq in zip(chunk, f2_seqs):
+            juntar.slide_compare_two(each[1], f2_seq, each[2], each[4], save_size)
+        seconds['slide_compare_two'] += time.perf_counter() - start
+
+    f1.close()
+    f2.close()
+
+    return(seconds)
+
+def run_juntar(prefix, threads):
+    output_file = prefix + '_joined.fastq'
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'juntar.py'),
+               '--fastq_1', prefix + '_R1.fastq',
+               '--fastq_2', prefix + '_R2.fastq',
+               '--vsearch', prefix + '_vsearch.fastq',
+               '--output_file', output_file,
+               '--threads', str(threads)]
+
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    seconds = time.perf_counter() - start
+
+    digest = hashlib.sha256()
+    joined_file = open(output_file, 'rb')
+    block = joined_file.read(1048576)
+    while block:
+        digest.update(block)
+        block = joined_file.read(1048576)
+    joined_file.close()
+
+    report_file = open(juntar.log_prefix(output_file) + '.json')
+    report = json.load(report_file)
+    report_file.close()
+
+    #kept apart, the largest worker's peak need not overlap the parent's
+    peak_rss = (report['peak_rss'].get('self_kb', ''), report['peak_rss'].get('children_kb', ''))
+
+    return(seconds, digest.hexdigest(), peak_rss)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    settings = {'read_length': 250, 'amplicon_min': 380, 'amplicon_max': 500,
+                'error_rate': 0.005, 'n_rate': 0.001, 'duplication_rate': 0.5,
+                'vsearch_fraction': 0.3, 'seed': 1}
+
+    for each in ['read_length', 'amplicon_min', 'amplicon_max', 'seed']:
+        if getattr(args, each):
+            settings[each] = int(getattr(args, each))
+
+    for each in ['error_rate', 'n_rate', 'duplication_rate', 'vsearch_fraction']:
+        if getattr(args, each):
+            settings[each] = float(getattr(args, each))
+
+    if args.pairs:
+        pair_sizes = [int(each) for each in args.pairs.split(',')]
+    else:
+        pair_sizes = [10000, 1000000, 10000000]
+
+    if args.threads:
+        threads = int(args.threads)
+    else:
+        threads = 1
+
+    work_folder = args.work_folder or '.'
+    os.makedirs(work_folder, exist_ok=True)
+
+    baseline = {}
+    if args.baseline_file and os.path.isfile(args.baseline_file):
+        baseline_file = open(args.baseline_file)
+        baseline = json.load(baseline_file)
+        baseline_file.close()
+
+    #the lane is part of the baseline key, so changing a setting never compares against another lane
+    lane_key = ('seed{seed}_len{read_length}_amp{amplicon_min}-{amplicon_max}_err{error_rate}'
+                '_n{n_rate}_dup{duplication_rate}_vs{vsearch_fraction}').format(**settings)
+
+    header = ('pairs\tstage\tseconds\tpairs_per_second\tjuntar_peak_rss_kb\tlargest_worker_peak_rss_kb\tbaseline\n')
+    print(header.strip())
+
+    if args.output_file:
+        outfile = open(args.output_file, 'w')
+        outfile.write(header)
+
+    differs = False
+
+    for pairs in pair_sizes:
+        prefix = os.path.join(work_folder, ('synthetic_{}').format(pairs))
+        generate_lane(prefix, pairs, settings)
+
+        seconds, digest, (juntar_rss, worker_rss) = run_juntar(prefix, threads)
+
+        baseline_key = ('{}_{}').format(lane_key, pairs)
+        if args.save_baseline:
+            baseline[baseline_key] = digest
+            match = 'saved'
+        elif baseline_key not in baseline:
+            match = 'none'
+        elif baseline[baseline_key] == digest:
+            match = 'identical'
+        else:
+            match = 'DIFFERS'
+
+        rows = [('end_to_end', seconds, juntar_rss, worker_rss, match)]
+        for kernel, kernel_seconds in time_kernels(prefix).items():
+            rows.append((kernel, kernel_seconds, '', '', ''))
+
+        for stage, stage_seconds, stage_rss, stage_worker_rss, stage_match in rows:
+            outline = ('{}\t{}\t{}\t{}\t{}\t{}\t{}\n').format(pairs, stage, round(stage_seconds, 3), round(pairs/stage_seconds, 1) if stage_seconds else '', stage_rss, stage_worker_rss, stage_match)
+            print(outline.strip())
+            if args.output_file:
+                outfile.write(outline)
+
+        if match == 'DIFFERS':
+            print(('Joined output for {} pairs differs from the baseline in {}').format(pairs, args.baseline_file))
+            differs = True
+
+    if args.output_file:
+        outfile.close()
+
+    if args.save_baseline and args.baseline_file:
+        baseline_file = open(args.baseline_file, 'w')
+        json.dump(baseline, baseline_file, indent=1, sort_keys=True)
+        baseline_file.close()
+
+    if differs:
+        sys.exit(1)
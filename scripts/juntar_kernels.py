@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+juntar_kernels.py
+
+Sequence kernels used by juntar.py. These take plain strings and settings and
+touch no globals, so they can be imported by juntar.py, its worker processes
+and anything that wants to time them.
+
+"""
+import math
+from operator import getitem
+import re
+
+#IUPAC complements, upper and lower case. U pairs with A, gaps map to themselves.
+iupac_complement = str.maketrans('ACGTUNRYKMSWBDHVacgtunrykmswbdhv',
+                                 'TGCAANYRMKSWVHDBtgcaanyrmkswvhdb')
+
+def reverse_complement_batch(seqs):
+    '''
+    Reverse complements a whole chunk of sequences at once. The sequences are
+    joined into one newline separated buffer, complemented with a single
+    translate and reversed as a whole, which reverses both the bases and the
+    order of the records, so the split is read back in reverse.
+    '''
+    return('\n'.join(seqs).translate(iupac_complement)[::-1].split('\n')[::-1])
+
+def reverse_batch(quals):
+    #same buffer trick as reverse_complement_batch, for quality strings
+    return('\n'.join(quals)[::-1].split('\n')[::-1])
+
+def find_overlap(f1_seq, f2_seq, minimum_overlap, maximum_overlap=100, minimum_length=250):
+    '''
+    Returns the longest exact overlap between the end of f1_seq and the start
+    of f2_seq that is between minimum_overlap and maximum_overlap long and
+    still gives a joined read of at least minimum_length, or 0 if none does.
+
+    This is the same answer as trying every overlap from maximum_overlap down
+    to minimum_overlap, but overlaps that cannot reach minimum_length are never
+    tried and str.find skips every start position where the first
+    minimum_overlap bases of f2_seq do not occur. Only those seed hits are
+    checked in full, left to right, so the first one that verifies is the
+    longest overlap.
+    '''
+    f1_len = len(f1_seq)
+    longest = min(maximum_overlap, f1_len, len(f2_seq), f1_len + len(f2_seq) - minimum_length)
+    shortest = max(minimum_overlap, 1)
+
+    if longest < shortest:
+        return(0)
+
+    seed = f2_seq[:shortest]
+    start = f1_seq.find(seed, f1_len - longest)
+
+    while (start != -1) and (start <= f1_len - shortest):
+        if f1_seq.startswith(f2_seq[:f1_len - start], start):
+            return(f1_len - start)
+
+        start = f1_seq.find(seed, start + 1)
+
+    return(0)
+
+def scan_overlap(f1_seq, f2_seq, shortest, longest, tried=()):
+    '''
+    The seeded scan of find_overlap between shortest and longest, also
+    returning how many overlap lengths were checked in full. Lengths in
+    tried are already known not to match and are passed over unchecked.
+    '''
+    f1_len = len(f1_seq)
+    comparisons = 0
+
+    seed = f2_seq[:shortest]
+    start = f1_seq.find(seed, f1_len - longest)
+
+    while (start != -1) and (start <= f1_len - shortest):
+        if (f1_len - start) not in tried:
+            comparisons += 1
+            if f1_seq.startswith(f2_seq[:f1_len - start], start):
+                return(f1_len - start, comparisons)
+
+        start = f1_seq.find(seed, start + 1)
+
+    return(0, comparisons)
+
+def find_overlap_ordered(f1_seq, f2_seq, minimum_overlap, likely, maximum_overlap=100, minimum_length=250):
+    '''
+    find_overlap that checks the overlap lengths in likely first, most
+    likely first, and returns (overlap, comparisons). A likely length that
+    matches is only kept once the scan of the longer lengths finds nothing,
+    and when none match the full scan runs over the lengths not yet tried,
+    so the overlap is always the one find_overlap gives.
+    '''
+    f1_len = len(f1_seq)
+    longest = min(maximum_overlap, f1_len, len(f2_seq), f1_len + len(f2_seq) - minimum_length)
+    shortest = max(minimum_overlap, 1)
+
+    if longest < shortest:
+        return(0, 0)
+
+    tried = set()
+
+    for overlap in likely:
+        if shortest <= overlap <= longest:
+            tried.add(overlap)
+            if f1_seq.endswith(f2_seq[:overlap]):
+                if overlap == longest:
+                    return(overlap, len(tried))
+                longer, comparisons = scan_overlap(f1_seq, f2_seq, overlap + 1, longest, tried)
+                return(longer or overlap, len(tried) + comparisons)
+
+    overlap, comparisons = scan_overlap(f1_seq, f2_seq, shortest, longest, tried)
+    return(overlap, len(tried) + comparisons)
+
+slide_tables = {}
+
+def build_slide_table(minimum_hits, maximum_mismatch, window):
+    '''
+    Replays the position by position hit/miss count of slide_compare_two for
+    every possible hit pattern over the window. Patterns are keyed the way
+    slide_hit_patterns builds them, one 0/1 byte per position.
+    '''
+    slide_table = {}
+
+    for pattern in range(2**window):
+        hit_pattern = bytes((pattern >> (window - 1 - index)) & 1 for index in range(window))
+        hit = 0
+        miss = 0
+        slide_table[hit_pattern] = -1
+
+        for index in range(window):
+            if hit_pattern[index]:
+                hit += 1
+            else:
+                miss += 1
+
+            if hit >= minimum_hits:
+                slide_table[hit_pattern] = index
+                break
+
+            if miss > maximum_mismatch:
+                break
+
+    return(slide_table)
+
+def slide_table(minimum_hits, maximum_mismatch, window=10):
+    key = (minimum_hits, maximum_mismatch, window)
+    if key not in slide_tables:
+        slide_tables[key] = build_slide_table(minimum_hits, maximum_mismatch, window)
+    return(slide_tables[key])
+
+def slide_hit_patterns(f1_seqs, f2_seqs, window=10):
+    '''
+    The last window bases of every f1 (read backwards) and the first window
+    bases of every f2 are packed into two byte strings and compared in a
+    single XOR, which is folded down to one mismatch bit per position.
+    Returns one pattern per pair, a 0/1 byte per position with 1 for a match.
+    Reads shorter than the window count the missing positions as mismatches.
+    '''
+    pair_ct = len(f1_seqs)
+    f1_tails = ''.join([f1_seq[:-window-1:-1].ljust(window, '<') for f1_seq in f1_seqs])
+    f2_heads = ''.join([f2_seq[:window].ljust(window, '>') for f2_seq in f2_seqs])
+
+    ones = int.from_bytes(b'\x01' * (window*pair_ct), 'big')
+
+    diff = int.from_bytes(f1_tails.encode(), 'big') ^ int.from_bytes(f2_heads.encode(), 'big')
+    diff |= diff >> 4
+    diff |= diff >> 2
+    diff |= diff >> 1
+    hits = (ones ^ (diff & ones)).to_bytes(window*pair_ct, 'big')
+
+    return([hits[start:start+window] for start in range(0, window*pair_ct, window)])
+
+def slide_overlap_batch(f1_seqs, f2_seqs, minimum_hits, maximum_mismatch, window=10, minimum_length=250):
+    '''
+    Bit-parallel form of the slide_compare_two search over a whole batch of
+    pairs. Each pair's hit pattern (see slide_hit_patterns) is looked up in a
+    table that holds, for every pattern, the position where the hit count
+    reaches minimum_hits before the misses run past maximum_mismatch.
+
+    Returns one position per pair, -1 where there is none or the joined read
+    would be shorter than minimum_length.
+    '''
+    table = slide_table(minimum_hits, maximum_mismatch, window)
+
+    indexes = []
+    for hit_pattern, f1_seq, f2_seq in zip(slide_hit_patterns(f1_seqs, f2_seqs, window), f1_seqs, f2_seqs):
+        index = table[hit_pattern]
+
+        if (index != -1) and ((len(f1_seq) + len(f2_seq) - index) < minimum_length):
+            index = -1
+
+        indexes.append(index)
+
+    return(indexes)
+
+#Phred+33 character to error probability
+error_probability = {chr(33 + quality): 10**(-quality/10) for quality in range(94)}
+
+def expected_errors(qual):
+    #sum of the error probabilities, looked up for the whole string in one map
+    return(sum(map(error_probability.__getitem__, qual)))
+
+truncate_patterns = {}
+
+def truncate_position(qual, truncate_quality):
+    '''
+    Position of the first base at or below truncate_quality, -1 if there is
+    none. One regex character class search over the quality string.
+    '''
+    if truncate_quality not in truncate_patterns:
+        low_qualities = ''.join(chr(33 + quality) for quality in range(truncate_quality + 1))
+        truncate_patterns[truncate_quality] = re.compile('[{}]'.format(re.escape(low_qualities)))
+
+    found = truncate_patterns[truncate_quality].search(qual)
+    if found:
+        return(found.start())
+
+    return(-1)
+
+#Phred+33 bytes to 1 where the base is below Q20 / at least Q30, padding (space) is neither
+below_q20_table = bytes((1 if 33 <= value < 53 else 0) for value in range(256))
+q30_table = bytes((1 if value >= 63 else 0) for value in range(256))
+
+def quality_columns(quals):
+    '''
+    Per position totals over a batch of quality strings: reads reaching the
+    position, summed quality, bases below Q20 and bases at Q30 or above.
+    The strings are padded with spaces to one length and joined into a single
+    buffer, so each position is a strided slice of it and is summed or
+    counted in one call.
+    '''
+    columns = {'reads': [], 'quality': [], 'below_q20': [], 'q30': []}
+    if not quals:
+        return(columns)
+
+    length = max(map(len, quals))
+    buffer = ''.join([qual.ljust(length) for qual in quals]).encode()
+    below_q20 = buffer.translate(below_q20_table)
+    q30 = buffer.translate(q30_table)
+
+    for position in range(length):
+        column = buffer[position::length]
+        reads = len(quals) - column.count(32)
+
+        columns['reads'].append(reads)
+        columns['quality'].append(sum(column) - 33*reads - 32*(len(quals) - reads))
+        columns['below_q20'].append(below_q20[position::length].count(1))
+        columns['q30'].append(q30[position::length].count(1))
+
+    return(columns)
+
+def build_merge_tables(maximum_quality=41):
+    '''
+    Tables for merge_batch, indexed [f1 quality byte][f2 quality byte] with
+    Phred+33 bytes. match_scores / mismatch_scores are the log2 odds of a
+    match / mismatch on a true overlap against a random one. same_qualities
+    and diff_qualities are the posterior quality of the consensus base when
+    the reads agree / disagree (Edgar & Flyvbjerg 2015), the better of the
+    two bases being called on a disagreement. Output is capped at
+    maximum_quality as vsearch does.
+    '''
+    probability = [1.0]*128
+    for value in range(33, 127):
+        probability[value] = 10**(-(value - 33)/10)
+
+    def quality_byte(error):
+        if error <= 0:
+            return(33 + maximum_quality)
+        return(33 + max(0, min(maximum_quality, round(-10*math.log10(error)))))
+
+    match_scores = []
+    mismatch_scores = []
+    same_qualities = []
+    diff_qualities = []
+
+    for value_1 in range(128):
+        p_1 = min(probability[value_1], 0.75)
+        match_row = []
+        mismatch_row = []
+        same_row = []
+        diff_row = []
+
+        for value_2 in range(128):
+            p_2 = min(probability[value_2], 0.75)
+            matching = (1 - p_1)*(1 - p_2) + p_1*p_2/3
+            match_row.append(math.log2(matching/0.25))
+            mismatch_row.append(math.log2((1 - matching)/0.75))
+
+            same_row.append(quality_byte((p_1*p_2/3)/(1 - p_1 - p_2 + 4*p_1*p_2/3)))
+
+            p_high, p_low = min(p_1, p_2), max(p_1, p_2)
+            diff_row.append(quality_byte(p_high*(1 - p_low/3)/(p_high + p_low - 4*p_high*p_low/3)))
+
+        match_scores.append(match_row)
+        mismatch_scores.append(mismatch_row)
+        same_qualities.append(bytes(same_row))
+        diff_qualities.append(bytes(diff_row))
+
+    return(match_scores, mismatch_scores, same_qualities, diff_qualities)
+
+merge_tables = []
+
+#1 for N (any case) and 0 otherwise, a base next to an N is never a mismatch
+n_table = bytes((1 if value in b'Nn' else 0) for value in range(256))
+
+def merge_batch(f1_seqs, f2_seqs, f1_quals, f2_quals, minimum_overlap=10, maximum_diffs=10, minimum_score=16.0, seed_length=8, seeds=6):
+    '''
+    Quality aware merge of a batch of pairs, f2 already reverse complemented
+    (quals reversed), the way vsearch fastq_mergepairs does it: candidate
+    overlaps come from seeds (seeds k-mers taken every seed_length bases
+    from the start of f2, found in f1), every candidate is scored with the
+    log odds tables of build_merge_tables and the best one is merged if it
+    has at most maximum_diffs mismatches and scores at least minimum_score
+    bits. In the overlap the agreed base, or the better one, is called with
+    its posterior quality.
+
+    The candidates of the whole batch are compared in one XOR, as in
+    slide_hit_patterns, and the per position scores and qualities are
+    table lookups mapped over the quality bytes.
+
+    Returns (seq, qual) per pair, or None where there is no merge.
+    '''
+    if not merge_tables:
+        merge_tables.extend(build_merge_tables())
+    match_scores, mismatch_scores, same_qualities, diff_qualities = merge_tables
+
+    candidates = []
+    for pair, (f1_seq, f2_seq) in enumerate(zip(f1_seqs, f2_seqs)):
+        f1_len = len(f1_seq)
+        longest = min(f1_len, len(f2_seq))
+        overlaps = set()
+
+        for seed_start in range(0, min(seed_length*seeds, longest - seed_length + 1), seed_length):
+            seed = f2_seq[seed_start:seed_start + seed_length]
+            hit = f1_seq.find(seed, f1_len - longest + seed_start)
+            while hit != -1:
+                overlaps.add(f1_len - hit + seed_start)
+                hit = f1_seq.find(seed, hit + 1)
+
+        for overlap in overlaps:
+            if overlap >= minimum_overlap:
+                candidates.append((pair, overlap))
+
+    merged = [None]*len(f1_seqs)
+    if not candidates:
+        return(merged)
+
+    f1_all = ''.join([f1_seqs[pair][-overlap:] for pair, overlap in candidates]).encode()
+    f2_all = ''.join([f2_seqs[pair][:overlap] for pair, overlap in candidates]).encode()
+    size = len(f1_all)
+
+    ones = int.from_bytes(b'\x01'*size, 'big')
+    diff = int.from_bytes(f1_all, 'big') ^ int.from_bytes(f2_all, 'big')
+    diff |= diff >> 4
+    diff |= diff >> 2
+    diff |= diff >> 1
+    diff &= ones
+    diff_bytes = diff.to_bytes(size, 'big')
+    n_bytes = (int.from_bytes(f1_all.translate(n_table), 'big') | int.from_bytes(f2_all.translate(n_table), 'big')).to_bytes(size, 'big')
+
+    best = {}
+    start = 0
+    for pair, overlap in candidates:
+        end = start + overlap
+        #every position where the bases differ, N or not
+        differing = []
+        mismatches = 0
+        position = diff_bytes.find(1, start, end)
+        while (position != -1) and (mismatches <= maximum_diffs):
+            differing.append(position - start)
+            if not n_bytes[position]:
+                mismatches += 1
+            position = diff_bytes.find(1, position + 1, end)
+
+        if mismatches <= maximum_diffs:
+            q1_bytes = f1_quals[pair][-overlap:].encode()
+            q2_bytes = f2_quals[pair][:overlap].encode()
+            score = sum(map(getitem, map(match_scores.__getitem__, q1_bytes), q2_bytes))
+            for position in differing:
+                score -= match_scores[q1_bytes[position]][q2_bytes[position]]
+                if not n_bytes[start + position]:
+                    score += mismatch_scores[q1_bytes[position]][q2_bytes[position]]
+
+            if (score >= minimum_score) and ((pair not in best) or (score > best[pair][0])):
+                best[pair] = (score, overlap, q1_bytes, q2_bytes, differing)
+
+        start = end
+
+    for pair, (score, overlap, q1_bytes, q2_bytes, differing) in best.items():
+        f1_seq = f1_seqs[pair]
+        f2_seq = f2_seqs[pair]
+        overlap_seq = list(f1_seq[-overlap:])
+        overlap_qual = bytearray(map(getitem, map(same_qualities.__getitem__, q1_bytes), q2_bytes))
+
+        for position in differing:
+            base_1 = overlap_seq[position]
+            base_2 = f2_seq[position]
+
+            if base_1 in 'Nn':
+                overlap_seq[position] = base_2
+                overlap_qual[position] = q2_bytes[position]
+            elif base_2 in 'Nn':
+                overlap_qual[position] = q1_bytes[position]
+            else:
+                if q2_bytes[position] > q1_bytes[position]:
+                    overlap_seq[position] = base_2
+                overlap_qual[position] = diff_qualities[q1_bytes[position]][q2_bytes[position]]
+
+        merged[pair] = (f1_seq[:-overlap] + ''.join(overlap_seq) + f2_seq[overlap:],
+                        f1_quals[pair][:-overlap] + overlap_qual.decode() + f2_quals[pair][overlap:])
+
+    return(merged)
@@ -4,7 +4,8 @@ Created on Tue Oct 22 09:29:45 2019
 
 Novembro - for identifying taxa enrichments from Qiime generated dat
 
-python novembro.py -f feature-table.biom.txt -t taxonomy.tsv -s silva -o taxa_counts.tab
+python novembro.py -f feature-table.biom.txt -t taxonomy.tsv -s silva -o taxa_counts.tab \
+    -m MappingFile_mangue.csv -g Site
 
 NB: feature-table.biom.txt should be generated from converting the qiime feature_table.biom file to a tsv
 #   biom convert -i feature-table.biom -o feature-table.biom.txt --to-tsv
@@ -21,21 +22,43 @@ Version: Public 1.4 (Art Charity)
     _x_ make coherent for BGS
     _x_ added arguments for 'pct_effect_size, pval_threshold'
     _x_ added binomial exact test for abundances
+Version: Public 1.5 (Single Reading)
+    _x_ taxonomy and feature table are read once, counts for every rank are
+        aggregated in one pass over the OTUs before the per rank statistics
+    _x_ feature table is loaded into a NumPy matrix and cached next to it as
+        feature-table.biom.txt.npz, reused while the table's size and mtime
+        (or, failing that, sha256) are unchanged
+Version: Public 1.6 (Any Site)
+    _x_ samples and sites come from the mapping file (--mapping_file, sites in
+        the --group_column, default Site) so any number of samples and sites
+        can be compared, without one the first nine columns are three sites of
+        three replicates as before and every table keeps its original header
+    _x_ per site sums, means, medians and corrections are reductions over the
+        samples axis of the count matrix, pairwise tests run for every pair of sites
+    _x_ the site and pairwise chi-square tests of every taxa are run at once
+        with batch_stats, same p-values as one chi2_contingency call per test
     
 @author: ps163@nyu.edu
 """
 
+import hashlib
+import os
+
 import numpy as np
 import scipy.stats as stats
 
 import plotly.graph_objects as go
 import argparse
 
+from batch_stats import chi2_kx2_pvalues, chi2_pvalues, contingency_tables
+
 parser = argparse.ArgumentParser()
 parser.add_argument('-f',"--feature_table")
 parser.add_argument('-t',"--taxonomy")
 parser.add_argument('-s',"--taxa_source")
 parser.add_argument('-o',"--output_file")
+parser.add_argument('-m',"--mapping_file")
+parser.add_argument('-g',"--group_column")
 
 parser.add_argument('-u',"--unique_sets")
 
@@ -62,6 +85,12 @@ else:
     
 feature_table_name = args.feature_table 
 taxa_file_name = args.taxonomy
+mapping_file_name = args.mapping_file
+
+if args.group_column:
+    group_column = args.group_column
+else:
+    group_column = 'Site'
 
 if args.taxa_source:
     taxa_source = args.taxa_source
@@ -82,10 +111,13 @@ pass_dict = {'criteria':0, 'pval':0, 'p_pval':0, 'pass_set':0, 'figure_dict':0}
 
 simplified_enrichment = {}
 
-def increment_pass_dict(p_1v2, p_1v3=1, p_2v3=1):
-    xlist = [p_1v2, p_1v3, p_2v3]
-    
-    for each_p in xlist:
+#one per site, in mapping file order
+group_colors = ['rgba(0, 89, 255, 0.5)', 'rgba(255, 165, 0, 0.5)', 'rgba(0, 0, 0, 0.5)',
+                'rgba(0, 158, 115, 0.5)', 'rgba(204, 121, 167, 0.5)', 'rgba(213, 94, 0, 0.5)',
+                'rgba(86, 180, 233, 0.5)', 'rgba(240, 228, 66, 0.5)']
+
+def increment_pass_dict(pair_pvals):
+    for each_p in pair_pvals:
         if each_p <= 0.05:
             return(1)
     return(0)
@@ -100,154 +132,264 @@ def evaluate_the_criteria(p_val, w_val, testname, max_effect_size, min_effect_si
         pass_set.append(testname)
     return(pass_set)
     
-def obs_counter(list_obs_ct):
-    obs = 0
-    
-    if max(list_obs_ct) > 100:
-        return(True)
-        
-    for obs_ct in list_obs_ct:
-        if obs_ct > 100:
-            obs+=1
+def find_correction_value(otu_matrix):
+    #Define number of observations per sample for the purposes of downsampling
+    sample_totals = otu_matrix.sum(axis=0)
+    global_min = sample_totals.min()
+    
+    return(global_min/sample_totals)
+
+def table_header(table_name, header):
+    #without a mapping file the three site tables keep the headers they were always written with
+    if not mapping_file_name:
+        return({'counts': '#taxa\tP1\tP2\tP3\tS1\tS2\tS3\tV1\tV2\n',
+                'log10_abundance': 'taxa\tsub_log10_abundance\tint_log10_abundance\tsup_log10_abundance\n',
+                'abundance': 'taxa\tsub\tinter\tsup\tsub_bet\tint_bet\tsup_bet\tmin_pval\n'}[table_name])
+    
+    return(header)
+    
+def build_sample_groups(mapping_file_name, group_column, sample_ids):
+    '''
+    Returns the sites in the order the mapping file first gives them and, per
+    site, the feature table columns of its samples. Without a mapping file the
+    first nine columns are three sites of three replicates.
+    '''
+    if not mapping_file_name:
+        return(['Sub', 'Inter', 'Supra'], [[0, 1, 2], [3, 4, 5], [6, 7, 8]])
+    
+    groups = []
+    group_columns = {}
+    sample_column = {sample: column for column, sample in enumerate(sample_ids)}
+    
+    mapping_file = open(mapping_file_name)
+    header = [each.strip() for each in mapping_file.readline().split('\t')]
+    group_index = header.index(group_column)
+    
+    for line in mapping_file:
+        if line.strip() and line[0]!='#':
+            line = line.rstrip('\n').split('\t')
+            sample = line[0].strip()
+            group = line[group_index].strip()
             
-    if obs > 1:
-        return(True)
-    else:
-        return(False)
-
-def find_correction_value(otu_counts):   
-    sub1, sub2, sub3 = 0, 0, 0
-    int1, int2, int3 = 0, 0, 0
-    sup1, sup2, sup3 = 0, 0, 0
-    
-    for otu in otu_counts:
-       osub1, osub2, osub3, oint1, oint2, oint3, osup1, osup2, osup3 = otu_counts[otu]
-       
-       sub1 += osub1
-       sub2 += osub2
-       sub3 += osub3
-       
-       int1 += oint1
-       int2 += oint2
-       int3 += oint3
-       
-       sup1 += osup1
-       sup2 += osup2
-       sup3 += osup3
-                   
-    global_min = min(min([sub1, sub2, sub3]),
-                     min([int1, int2, int3]),
-                     min([sup1, sup2, sup3])
-                     )
-    
-    #Define number of observations per site for the purposes of downsampling
-    ct_cor_1, ct_cor_2, ct_cor_3 = global_min/sub1, global_min/sub2, global_min/sub3
-    g_cor_1, g_cor_2, g_cor_3 = global_min/int1, global_min/int2, global_min/int3  
-    ol_cor_1, ol_cor_2, ol_cor_3 = global_min/sup1, global_min/sup2, global_min/sup3
-    
-    return(ct_cor_1, ct_cor_2, ct_cor_3, g_cor_1, g_cor_2, g_cor_3, ol_cor_1, ol_cor_2, ol_cor_3)
-
-def build_otu_counts(feature_table_name):
-#this is to build the 
-    otu_file = open(feature_table_name)
-    
-    otu_counts = {}
-    
-    for line in otu_file:
-        if line[0]!='#' and 'Feature ID' not in line:
+            if sample not in sample_column:
+                print(('{} is not in the feature table, left out').format(sample))
+                continue
+                
+            if group not in group_columns:
+                groups.append(group)
+                group_columns[group] = []
+            group_columns[group].append(sample_column[sample])
+            
+    mapping_file.close()
+    
+    return(groups, [group_columns[group] for group in groups])
+
+def parse_feature_table(feature_table_text):
+    '''
+    Parses the biom tsv into the OTU IDs, the sample IDs from the '#OTU ID'
+    header and a (OTU x sample) matrix of counts. Only the IDs are split off
+    line by line, the counts are converted in one call.
+    '''
+    otu_ids = []
+    sample_ids = []
+    count_fields = []
+    
+    for line in feature_table_text.splitlines():
+        if line.startswith('#OTU ID'):
+            sample_ids = [each.strip() for each in line.split('\t')[1:]]
+            
+        elif line.strip() and line[0]!='#' and 'Feature ID' not in line:
             #OTU ID	sub1	sub2	sub3	int1	int2	int3	sup1	sup2	sup3	S1	S2	S3
+            otu, fields = line.split('\t', 1)
+            otu_ids.append(otu.strip())
+            count_fields.append(fields)
+    
+    otu_matrix = np.fromstring(' '.join(count_fields), sep=' ')
+    otu_matrix = otu_matrix.reshape(len(otu_ids), -1)
+    
+    return(otu_ids, sample_ids, otu_matrix)
+
+def load_feature_table(feature_table_name):
+    '''
+    Returns {otu: row}, the sample IDs and the (OTU x sample) count matrix of
+    the feature table. The parsed table is cached next to it as .npz, keyed by
+    the table's size and mtime and, when only the mtime changed, its sha256.
+    '''
+    cache_name = feature_table_name + '.npz'
+    table_stat = os.stat(feature_table_name)
+    
+    if os.path.isfile(cache_name):
+        cache = np.load(cache_name)
+        if int(cache['size']) == table_stat.st_size:
+            cache_valid = (int(cache['mtime_ns']) == table_stat.st_mtime_ns)
+            
+            if not cache_valid:
+                table_hash = hashlib.sha256()
+                table_file = open(feature_table_name, 'rb')
+                block = table_file.read(1048576)
+                while block:
+                    table_hash.update(block)
+                    block = table_file.read(1048576)
+                table_file.close()
+                cache_valid = (str(cache['sha256']) == table_hash.hexdigest())
+                
+            if cache_valid:
+                otu_ids = cache['otu_ids'].tolist()
+                otu_index = {otu: row for row, otu in enumerate(otu_ids)}
+                return(otu_index, cache['sample_ids'].tolist(), cache['otu_matrix'])
+    
+    table_file = open(feature_table_name, 'rb')
+    table_bytes = table_file.read()
+    table_file.close()
+    
+    otu_ids, sample_ids, otu_matrix = parse_feature_table(table_bytes.decode())
+    
+    try:
+        #written aside and renamed, so an interrupted run leaves no half cache
+        cache_file = open(cache_name + '.tmp', 'wb')
+        np.savez(cache_file, otu_ids=np.array(otu_ids, dtype=str), sample_ids=np.array(sample_ids, dtype=str),
+                 otu_matrix=otu_matrix, size=table_stat.st_size, mtime_ns=table_stat.st_mtime_ns,
+                 sha256=hashlib.sha256(table_bytes).hexdigest())
+        cache_file.close()
+        os.replace(cache_name + '.tmp', cache_name)
+    except OSError as err:
+        print(('Feature table cache {} not written: {}').format(cache_name, err))
+    
+    otu_index = {otu: row for row, otu in enumerate(otu_ids)}
+    return(otu_index, sample_ids, otu_matrix)
+    
+def build_taxonomy(taxa_file_name):
+    #(otu, taxa) per taxonomy line, prefixes stripped and ranks joined by '_'
+    taxonomy = []
+    
+    taxa_file = open(taxa_file_name)
+    
+    for line in taxa_file:
+        if line[0]!='#':
+            line = line.replace('"','')
             line = line.strip()
-            otu = line.split('\t')[0].strip()# 
-            #
-            sub1 = float(line.split('\t')[1])
-            sub2 = float(line.split('\t')[2])  
-            sub3 = float(line.split('\t')[3])
-            #
-            int1 = float(line.split('\t')[4])
-            int2 = float(line.split('\t')[5])  
-            int3 = float(line.split('\t')[6])
-            #
-            sup1 = float(line.split('\t')[7])
-            sup2 = float(line.split('\t')[8])  
-            sup3 = float(line.split('\t')[9])            
-            otu_counts[otu] = [sub1, sub2, sub3, int1, int2, int3, sup1, sup2, sup3]
-    #        
-    otu_file.close()
-    return(otu_counts)
+            otu = line.split('\t')[0]
+            taxa = line.split('\t')[1]
+
+            for each in prefixe:
+                taxa = taxa.replace(each,'')
+
+            taxa = taxa.replace(';','_')
+            while taxa[-1] == '_':
+                taxa = taxa[:-1]
+            
+            taxonomy.append((otu, taxa))
+                
+    taxa_file.close()
+    return(taxonomy)
+    
+def build_rank_tables(taxonomy, otu_index, otu_matrix):
+    '''
+    Aggregates the OTU counts for every rank of rank_order in one pass over
+    the taxonomy. For each rank returns the taxa_set of full taxa names deep
+    enough for it, the taxa cut back to that rank in the order they are first
+    seen and their summed counts, a row per taxa.
+    '''
+    rank_rows = {}
+    rank_sets = {}
+    rank_otus = {}
+    for taxa_cutoff_name in rank_order:
+        rank_rows[taxa_cutoff_name] = {}
+        rank_sets[taxa_cutoff_name] = set()
+        rank_otus[taxa_cutoff_name] = set()
+    
+    for otu, taxa in taxonomy:
+        depth = taxa.count('_')
+        taxa_list = taxa.split('_')
+        row = otu_index.get(otu)
+        
+        for taxa_cutoff_name in rank_order:
+            taxa_cutoff_num = convert_taxa_to_rank[taxa_cutoff_name]
+            
+            if depth >= taxa_cutoff_num:
+                rank_sets[taxa_cutoff_name].add(taxa)
+                
+                rank_taxa = taxa
+                if depth > taxa_cutoff_num:
+                    rank_taxa = '_'.join(taxa_list[:taxa_cutoff_num+1])
+                
+                taxa_rows = rank_rows[taxa_cutoff_name].setdefault(rank_taxa, [])
+                if row is not None:
+                    taxa_rows.append(row)
+                
+                if otu in rank_otus[taxa_cutoff_name]:
+                    print('err')
+                rank_otus[taxa_cutoff_name].add(otu)
     
-def criteria(p_set, s_set, v_set, p_1v2, p_1v3, p_2v3, pval, taxa, pct_effect_size=0.05, pval_threshold=0.05):
+    rank_tables = {}
+    for taxa_cutoff_name in rank_order:
+        taxa_names = list(rank_rows[taxa_cutoff_name])
+        rank_matrix = np.zeros((len(taxa_names), otu_matrix.shape[1]))
+        
+        taxa_index = []
+        otu_rows = []
+        for taxa_row, taxa_rows in enumerate(rank_rows[taxa_cutoff_name].values()):
+            taxa_index += [taxa_row]*len(taxa_rows)
+            otu_rows += taxa_rows
+        np.add.at(rank_matrix, taxa_index, otu_matrix[otu_rows])
+        
+        rank_tables[taxa_cutoff_name] = (rank_sets[taxa_cutoff_name], taxa_names, rank_matrix)
+    
+    return(rank_tables)
+    
+def criteria(group_total, group_means, pair_pvals, pval, taxa, pct_effect_size=0.05, pval_threshold=0.05):
     pass_set = []
     
     global pass_dict
         
     pass_dict['criteria']+=1
     #print(taxa)
-    if (sum(p_set)+ sum(s_set) + sum(v_set)) >= 100:
+    if group_total >= 100:
         if (pval <= pval_threshold):
             pass_dict['pval']+=1
             max_effect_size = (1+pct_effect_size)
             min_effect_size = (1-pct_effect_size)
             
-            p_mean = np.mean(p_set)
-            s_mean = np.mean(s_set)
-            v_mean = np.mean(v_set)
-                    
-            if p_mean == 0:
-                p_mean = 1
-            if s_mean == 0:
-                s_mean = 1
-            if v_mean == 0:
-                v_mean = 1  
-                              
-            w_1v2 = (p_mean/s_mean)
-            w_1v3 = (p_mean/v_mean)
-            w_2v3 = (s_mean/v_mean)
+            group_means = [each_mean if each_mean != 0 else 1 for each_mean in group_means]
             
-            #log_fold_diff = [w_1v2, w_1v3, w_1v4, w_2v3, w_2v4, w_3v4]
-            
-            pass_dict['p_pval'] += increment_pass_dict(p_1v2, p_1v3, p_2v3)
-            #print((p_1v2, p_1v3, p_2v3))
-            #print(w_1v2, w_1v3, w_2v3)
+            pass_dict['p_pval'] += increment_pass_dict(pair_pvals)
             #
-            pass_set = evaluate_the_criteria(p_1v2, w_1v2, '1v2', max_effect_size, min_effect_size, pval_threshold, pass_set)
-            print(pass_set)
-            pass_set = evaluate_the_criteria(p_1v3, w_1v3, '1v3', max_effect_size, min_effect_size, pval_threshold, pass_set)
-            print(pass_set)
-            pass_set = evaluate_the_criteria(p_2v3, w_2v3, '2v3', max_effect_size, min_effect_size, pval_threshold, pass_set)
-            print(pass_set)
+            for (x_group, y_group), p_xvy in zip(group_pairs, pair_pvals):
+                w_xvy = (group_means[x_group]/group_means[y_group])
+                testname = ('{}v{}').format(x_group+1, y_group+1)
+                pass_set = evaluate_the_criteria(p_xvy, w_xvy, testname, max_effect_size, min_effect_size, pval_threshold, pass_set)
+                print(pass_set)
                     
         if len(pass_set) >= 2:
             return(True)            
 
     return(False)
+
+def log10_matrix(matrix, fraction_correction=False):
+    #log10 of every count, 0 for zeros (or, with fraction_correction, anything below 1)
+    logged = np.zeros(matrix.shape)
+    
+    if fraction_correction:
+        np.log10(matrix, out=logged, where=(matrix >= 1))
+    else:
+        np.log10(matrix, out=logged, where=(matrix != 0))
         
-def test_max(set_list, max_obs):
-    for each_set in set_list:
-        if max(each_set) >= max_obs:
-            max_obs = max(each_set)
-    return(max_obs)
-
-def return_log10(each_set, fraction_correction=False):
-    new_set = []
-    
-    for each_obs in each_set:
-        if fraction_correction:
-            if each_obs < 1:
-                each_obs = 0
-            else:
-                each_obs = np.log10(each_obs)
-        else:
-            if each_obs == 0:
-                each_obs = 0
-            else:
-                each_obs = np.log10(each_obs)
-
-        new_set.append(each_obs)
-                
-    return(new_set)
+    return(logged)
+    
+def group_reduce(matrix, reduction=np.add):
+    #one column per group, reducing the group's samples (they sit side by side)
+    return(reduction.reduceat(matrix, group_starts, axis=1))
     
-def return_deets(x_array, y_array):
-    return(x_array, np.mean(x_array), np.std(x_array), y_array, obs_counter(y_array))
+def group_medians(matrix):
+    medians = np.zeros((matrix.shape[0], len(groups)))
+    
+    for group_index, start in enumerate(group_starts):
+        medians[:, group_index] = np.median(matrix[:, start:start+group_sizes[group_index]], axis=1)
+        
+    return(medians)
+    
+def group_color(group_index):
+    return(group_colors[group_index % len(group_colors)])
     
 def run_mwu(x, y, z):
     pval_x_y, pval_x_z, pval_y_z = 1, 1, 1
@@ -271,18 +413,10 @@ def run_kruskal(x_set, y_set):
     else:
         return(1)
     
-def run_kruskal_3way(x_set, y_set, z_set):
-    if sum(x_set) > 30 or sum(y_set) > 30 or sum(z_set) > 30:
-        _w, p_xvy = stats.kruskal(x_set, y_set, z_set)
-        return(p_xvy)
-    else:
-        return(1)
-        
-def run_chi2(x_num, x_den, y_num, y_den):
-    if (x_num) > 5 or (y_num) > 5:
-        obs = np.array([[max(x_num,1), x_den], [max(y_num,1), y_den]])
-        chi2, pval, dof, expected = stats.chi2_contingency(obs, correction=True)
-        return(pval)
+def run_kruskal_groups(group_sets):
+    if max([sum(each_set) for each_set in group_sets]) > 30:
+        _w, p_groups = stats.kruskal(*group_sets)
+        return(p_groups)
     else:
         return(1)
         
@@ -291,539 +425,276 @@ def mod_null_set(isset):
         isset.append(0)
     return(isset)
     
-def simplify_enrichment(taxa, p12, p13, p23, p_med, s_med, v_med):
+def simplify_enrichment(taxa, pair_pvals, group_meds):
+    '''
+    A group is high (low) when it differs from every other group and its
+    median is above (below) all of theirs. When every pair differs only
+    the high group is called. Later groups take precedence.
+    '''
     global simplified_enrichment
     
-    print(taxa, p12, p13, p23, p_med, s_med, v_med)
+    print(taxa, pair_pvals, group_meds)
     simplified_enrichment[taxa] = 'complex'
     
-    if max(p12,p13,p23)<=0.05:
-        if p_med > s_med and p_med > v_med:
-            simplified_enrichment[taxa]='Sub_high'
-        if s_med > p_med and s_med > v_med:
-            simplified_enrichment[taxa]='Inter_high'
-        if v_med > p_med and v_med > s_med:
-            simplified_enrichment[taxa]='Supra_high'        
-    else:
-        if p12 <= 0.05 and p13 <= 0.05:
-            if p_med > s_med and p_med > v_med:
-                simplified_enrichment[taxa]='Sub_high'
-            if p_med < s_med and p_med < v_med:
-                simplified_enrichment[taxa]='Sub_low'
-    
-        if p12 <= 0.05 and p23 <= 0.05:
-            if s_med > p_med and s_med > v_med:
-                simplified_enrichment[taxa]='Inter_high'
-            if s_med < p_med and s_med < v_med:
-                simplified_enrichment[taxa]='Inter_low'           
-
-        if p13 <= 0.05 and p23 <= 0.05:
-            if v_med > p_med and v_med > s_med:
-                simplified_enrichment[taxa]='Supra_high'
-            if v_med < p_med and v_med < s_med:
-                simplified_enrichment[taxa]='Supra_low'
+    pair_pval = dict(zip(group_pairs, pair_pvals))
+    all_differ = (max(pair_pvals)<=0.05)
+    
+    for group_index, group in enumerate(groups):
+        other_meds = [each_med for other_index, each_med in enumerate(group_meds) if other_index != group_index]
+        
+        differs = True
+        for other_index in range(len(groups)):
+            if other_index != group_index:
+                if pair_pval[(min(group_index, other_index), max(group_index, other_index))] > 0.05:
+                    differs = False
+        
+        if differs:
+            if group_meds[group_index] > max(other_meds):
+                simplified_enrichment[taxa]=('{}_high').format(group)
+            if not all_differ and group_meds[group_index] < min(other_meds):
+                simplified_enrichment[taxa]=('{}_low').format(group)
         
     return(simplified_enrichment[taxa])
     
+def plot_group_scatter(taxa_list, taxa_values, title, xaxis_title, outfile_name):
+    #one marker per taxa and group, with taxa_values holding a value per group for each taxa
+    fig = go.Figure()
     
-def plot_top10_taxa(all_taxa_dict, prefix_name, pct_threshold=0.01):
-    #taxa_dict[taxa][0] += sum(pristine)
-    #taxa_dict['total'][0] += sum(pristine)
+    for group_index, group in enumerate(groups):
+        fig.add_trace(go.Scatter(
+            y=taxa_list,
+            x=[values[group_index] for values in taxa_values],
+            marker=dict(color=group_color(group_index), size=10),
+            mode="markers",
+            name=group,
+        ))
+
+    fig.update_layout(title=title,
+                      xaxis_title=xaxis_title,
+                      yaxis_title="Taxa",
+                      font_size=10,
+                      width=1500,
+                      height=1500)
     
+    fig.write_image(outfile_name)
+    
+def plot_top10_taxa(taxa_names, taxa_matrix, group_totals, prefix_name, pct_threshold=0.01):
     logfile_name = ('taxonomic_abundance_{}_{}_{}.log').format(prefix_name, pct_threshold, taxa_cutoff_name)
     logfile = open(logfile_name, 'w')
-    header = ('taxa\tsub_log10_abundance\tint_log10_abundance\tsup_log10_abundance\n')
+    header = table_header('log10_abundance', ('taxa\t{}\n').format('\t'.join([('{}_log10_abundance').format(group.lower()) for group in groups])))
     logfile.write(header)
     
-    specific_taxa_dict = {'taxa':[],'CT':[], 'G':[], 'OL':[]}
-    
-    pct_ct = taxa_dict['total'][0]*pct_threshold
-    pct_g = taxa_dict['total'][1]*pct_threshold
-    pct_ol = taxa_dict['total'][2]*pct_threshold
+    minimum_threshold = min(group_totals)*pct_threshold
     
-    minimum_threshold = min([pct_ct, pct_g, pct_ol])
+    group_sums = group_reduce(taxa_matrix)
+    group_logs = group_reduce(log10_matrix(taxa_matrix, True))
+    taxa_row = {taxa: row for row, taxa in enumerate(taxa_names)}
     
-    taxa_list = list(all_taxa_dict.keys())
+    taxa_list = list(taxa_names)
     taxa_list.sort(reverse=True)
     
+    specific_taxa = []
+    specific_logs = []
+    
     for taxa in taxa_list:
-        abundances = all_taxa_dict[taxa]
-        if taxa != 'total' and taxa != 'observed':
-            s_ct, s_g, s_ol = sum(abundances[0]), sum(abundances[1]), sum(abundances[2]), 
-            if max([s_ct, s_g, s_ol]) >= minimum_threshold:
-                l_ct, l_g, l_ol = sum(return_log10(abundances[0], True)), sum(return_log10(abundances[1], True)), sum(return_log10(abundances[2], True))
-                specific_taxa_dict['taxa'].append(taxa) 
-                specific_taxa_dict['CT'].append(l_ct)
-                specific_taxa_dict['G'].append(l_g)
-                specific_taxa_dict['OL'].append(l_ol)
-
-                outline = ('{}\t{}\t{}\t{}\n').format(taxa, l_ct, l_g, l_ol)
-                logfile.write(outline)
+        row = taxa_row[taxa]
+        if group_sums[row].max() >= minimum_threshold:
+            specific_taxa.append(taxa)
+            specific_logs.append(group_logs[row].tolist())
+
+            outline = ('{}\t{}\n').format(taxa, '\t'.join([str(each) for each in specific_logs[-1]]))
+            logfile.write(outline)
     
     logfile.close()        
     outfile_name = ('taxonomic_abundance_{}_{}_{}_.pdf').format(prefix_name, pct_threshold, taxa_cutoff_name)
-        
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        y=specific_taxa_dict['taxa'],
-        x=specific_taxa_dict['CT'],
-        marker=dict(color='rgba(0, 89, 255 0.5)', size=10),
-        mode="markers",
-        name="Sublittoral",
-    ))
-        
-    fig.add_trace(go.Scatter(
-        y=specific_taxa_dict['taxa'],
-        x=specific_taxa_dict['G'],
-        marker=dict(color='rgba(255, 165, 0, 0.5)', size=10),
-        mode="markers",
-        name="Intertidal",
-    ))
-    
-    fig.add_trace(go.Scatter(
-        y=specific_taxa_dict['taxa'],
-        x=specific_taxa_dict['OL'],
-        marker=dict(color='rgba(0, 0, 0, 0.5)', size=10),
-        mode="markers",
-        name="Supralittoral",
-    ))
-
-    fig.update_layout(title='Family Level Taxonomic Abundances',
-                      xaxis_title="Log10 Taxa Abundance",
-                      yaxis_title="Taxa",
-                      font_size=10,
-                      width=1500,
-                      height=1500)
     
-    fig.write_image(outfile_name)
-        
-for taxa_cutoff_name in rank_order:
-    taxa_cutoff_num = convert_taxa_to_rank[taxa_cutoff_name]
-    
-    taxa_set = set()
-    taxa_to_otu_dict = {}
-    otu_to_taxa_dict = {}
+    plot_group_scatter(specific_taxa, specific_logs, 'Family Level Taxonomic Abundances', "Log10 Taxa Abundance", outfile_name)
     
-    taxa_file = open(taxa_file_name)
+def write_abundance_table(all_outfile_name, taxa_names, group_sums):
+    #binomial exact test of each group's share of the taxa against an even split, bonferroni corrected
+    all_outfile = open(all_outfile_name, 'w')
+    header = table_header('abundance', ('taxa\t{}\t{}\tmin_pval\n').format('\t'.join([group.lower() for group in groups]), '\t'.join([('{}_bet').format(group.lower()) for group in groups])))
+    all_outfile.write(header)
     
-    for line in taxa_file:
-        if line[0]!='#':
-            line = line.replace('"','')
-            line = line.strip()
-            otu = line.split('\t')[0]
-            taxa = line.split('\t')[1]
-
-            for each in prefixe:
-                taxa = taxa.replace(each,'')
-
-            taxa = taxa.replace(';','_')
-            while taxa[-1] == '_':
-                taxa = taxa[:-1]
-                                   
-            if taxa.count('_') >= taxa_cutoff_num:
-                taxa_set.add(taxa)
-                
-                if taxa.count('_') > taxa_cutoff_num:
-                    taxa_list = taxa.split('_')[:taxa_cutoff_num+1]
-                    taxa = ''
-                    for each in taxa_list:
-                        taxa+=str(each)+'_'
-                    
-                    if taxa[-1] == '_':
-                        taxa = taxa[:-1]
-                                
-                if taxa not in taxa_to_otu_dict:
-                    taxa_to_otu_dict[taxa] = [otu]
-                else:
-                    taxa_to_otu_dict[taxa].append(otu)
-                    
-                if otu not in otu_to_taxa_dict:
-                    otu_to_taxa_dict[otu] = taxa
+    group_totals = group_sums.sum(axis=1)
     
-                else:
-                    print('err')
+    for row, taxa in enumerate(taxa_names):
+        total_s = group_totals[row]
+        group_stats = [1]*len(groups)
+        pval = 1
+        if total_s >= 100:
+            if (group_sums[row].max()/total_s) >= 0.05:
+                group_stats = [stats.binom_test(group_s, n=total_s, p=1/len(groups), alternative='two-sided')*len(taxa_names) for group_s in group_sums[row]]
+        
+                if len([x for x in group_stats if x <= 0.05]) > 1:
+                    pval = min(group_stats)
                 
-    taxa_file.close()
-    
-    otu_counts = build_otu_counts(feature_table_name)
-    ct_cor_1, ct_cor_2, ct_cor_3, g_cor_1, g_cor_2, g_cor_3, ol_cor_1, ol_cor_2, ol_cor_3 = find_correction_value(otu_counts)
+        outline = ('{}\t{}\t{}\t{}\n').format(taxa, '\t'.join([str(each) for each in group_sums[row].tolist()]), '\t'.join([str(each) for each in group_stats]), pval)
+        all_outfile.write(outline)
+
+    all_outfile.close()
     
-    taxa_to_counts = {}
-    for taxa, otus in taxa_to_otu_dict.items():
-        sub1, sub2, sub3 = 0, 0, 0
-        int1, int2, int3 = 0, 0, 0
-        sup1, sup2, sup3 = 0, 0, 0
-        
-        for otu in otus:
-            if otu in otu_counts:
-               osub1, osub2, osub3, oint1, oint2, oint3, osup1, osup2, osup3 = otu_counts[otu]
-               sub1 += osub1
-               sub2 += osub2
-               sub3 += osub3
-               
-               int1 += oint1
-               int2 += oint2
-               int3 += oint3
-               
-               sup1 += osup1
-               sup2 += osup2
-               sup3 += osup3
-               
-        taxa_to_counts[taxa] = [sub1, sub2, sub3, int1, int2, int3, sup1, sup2, sup3]
+#both inputs are read once, every rank is aggregated from them in one pass
+otu_index, sample_ids, otu_matrix = load_feature_table(feature_table_name)
+
+groups, group_columns = build_sample_groups(mapping_file_name, group_column, sample_ids)
+#samples of a group side by side, so every per group reduction is one reduceat over the samples axis
+sample_order = [column for columns in group_columns for column in columns]
+group_sizes = [len(columns) for columns in group_columns]
+group_starts = np.cumsum([0] + group_sizes[:-1])
+group_pairs = [(x_group, y_group) for x_group in range(len(groups)) for y_group in range(x_group+1, len(groups))]
+
+otu_matrix = otu_matrix[:, sample_order]
+group_sample_ids = [sample_ids[column] for column in sample_order]
+
+correction = find_correction_value(otu_matrix)
+rank_tables = build_rank_tables(build_taxonomy(taxa_file_name), otu_index, otu_matrix)
+
+for taxa_cutoff_name in rank_order:
+    taxa_set, taxa_names, raw_matrix = rank_tables[taxa_cutoff_name]
     
     outfile = open(args.output_file+'_counts.tsv', 'w')
-    header = ('#taxa\tP1\tP2\tP3\tS1\tS2\tS3\tV1\tV2\n')
+    header = table_header('counts', ('#taxa\t{}\n').format('\t'.join(group_sample_ids)))
     outfile.write(header)
     
-    for taxa, cts in taxa_to_counts.items():
-        sub1, sub2, sub3, int1, int2, int3, sup1, sup2, sup3 = cts
-        outline = ('{taxa}\t{sub1}\t{sub2}\t{sub3}\t{int1}\t{int2}\t{int3}\t{sup1}\t{sup2}\t{sup3}\n').format(taxa=taxa, int1=int1, int2=int2, int3=int3, sub1=sub1, sub2=sub2, sub3=sub3, sup1=sup1, sup2=sup2, sup3=sup3)        
+    for row, taxa in enumerate(taxa_names):
+        outline = ('{}\t{}\n').format(taxa, '\t'.join([str(each) for each in raw_matrix[row].tolist()]))
         outfile.write(outline)
     outfile.close()
-        
-    #store otu data
-    taxa_dict = {'total':[0,0,0], 'observed':0}  
-    
-    taxa_raw_dict = {}
-    
-    for taxa, counts in taxa_to_counts.items():
-        #
-        sub1 = counts[0]
-        sub2 = counts[1]
-        sub3 = counts[2]
-        raw_ct = [sub1, sub2, sub3]
-        #
-        int1 = counts[3]
-        int2 = counts[4]  
-        int3 = counts[5]
-        raw_g = [int1, int2, int3]
-        #
-        sup1 = counts[6]
-        sup2 = counts[7]  
-        sup3 = counts[8]
-        raw_ol = [sup1, sup2, sup3]
-        #      
-        if taxa not in taxa_raw_dict:
-            taxa_raw_dict[taxa] = [raw_ct, raw_g, raw_ol]
-        else:
-            for index in range(3):
-                taxa_raw_dict[taxa][0][index] += raw_ct[index]
-                taxa_raw_dict[taxa][1][index] += raw_g[index]
-                taxa_raw_dict[taxa][2][index] += raw_ol[index]
-        #
-        sub1 = counts[0]*ct_cor_1
-        sub2 = counts[1]*ct_cor_2
-        sub3 = counts[2]*ct_cor_3
-        cor_ct = [sub1, sub2, sub3]
-        #
-        int1 = counts[3]*g_cor_1
-        int2 = counts[4]*g_cor_2
-        int3 = counts[5]*g_cor_3
-        cor_g = [int1, int2, int3]
-        #
-        sup1 = counts[6]*ol_cor_1
-        sup2 = counts[7]*ol_cor_2
-        sup3 = counts[8]*ol_cor_3
-        cor_ol = [sup1, sup2, sup3]
-        #           
-        if taxa not in taxa_dict:
-            taxa_dict[taxa] = [cor_ct, cor_g, cor_ol]
-        else:
-            for index in range(3):
-                taxa_dict[taxa][0][index] += cor_ct[index]
-                taxa_dict[taxa][1][index] += cor_g[index]
-                taxa_dict[taxa][2][index] += cor_ol[index]
-                
-        taxa_dict['total'][0] += sum(cor_ct)
-        taxa_dict['total'][1] += sum(cor_g)
-        taxa_dict['total'][2] += sum(cor_ol)
-        
-        taxa_dict['observed'] += len([s for s in cor_ct if s != 1]) + len([s for s in cor_g if s != 1]) + len([s for s in cor_ol if s != 1])
-        
-    header = ('taxa\tsub\tinter\tsup\tsub_bet\tint_bet\tsup_bet\tmin_pval\n')
     
-    all_outfile_name = ('all_unnormalized_taxa_abundance_{}.tab').format(taxa_cutoff_name)
-    all_outfile = open(all_outfile_name, 'w')
-    all_outfile.write(header)
+    #every sample downsampled to the smallest
+    cor_matrix = raw_matrix*correction
     
-    for taxa, raw_taxa_array  in taxa_raw_dict.items():
-        sub_s = sum(raw_taxa_array[0])
-        int_s = sum(raw_taxa_array[1])
-        sup_s = sum(raw_taxa_array[2])
-        
-        total_s = sub_s+int_s+sup_s
-        pval = 1
-        if total_s >= 100:
-            if max((sub_s/total_s),(int_s/total_s),(sup_s/total_s)) >= 0.05:
-                sub_stat = stats.binom_test(sub_s, n=total_s, p=0.333, alternative='two-sided')*len(taxa_raw_dict)
-                int_stat = stats.binom_test(int_s, n=total_s, p=0.333, alternative='two-sided')*len(taxa_raw_dict)
-                sup_stat = stats.binom_test(sup_s, n=total_s, p=0.333, alternative='two-sided')*len(taxa_raw_dict)
-        
-                if len([x for x in [sub_stat, int_stat, sup_stat] if x <= 0.05]) > 1:
-                    pval = min([sub_stat, int_stat, sup_stat])
-                
-                
-        outline = ('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n').format(taxa, sub_s, int_s, sup_s, sub_stat, int_stat, sup_stat, pval)
-        all_outfile.write(outline)
-
-    all_outfile.close()
+    raw_sums = group_reduce(raw_matrix)
+    cor_sums = group_reduce(cor_matrix)
     
-    all_outfile_name = ('all_normalized_taxa_abundance_{}.tab').format(taxa_cutoff_name)
-    all_outfile = open(all_outfile_name, 'w')
-    all_outfile.write(header)
+    group_totals = cor_sums.sum(axis=0)
     
-    for taxa, taxa_array in taxa_dict.items():
-        if taxa != 'total' and taxa != 'observed':
-            sub_s = sum(taxa_array[0])
-            int_s = sum(taxa_array[1])
-            sup_s = sum(taxa_array[2])
-            
-            total_s = sub_s+int_s+sup_s
-            pval = 1
-            if total_s >= 100:
-                if max((sub_s/total_s),(int_s/total_s),(sup_s/total_s))>=0.05:
-                    sub_stat = stats.binom_test(sub_s, n=total_s, p=0.333, alternative='two-sided')*len(taxa_raw_dict)
-                    int_stat = stats.binom_test(int_s, n=total_s, p=0.333, alternative='two-sided')*len(taxa_raw_dict)
-                    sup_stat = stats.binom_test(sup_s, n=total_s, p=0.333, alternative='two-sided')*len(taxa_raw_dict)
-            
-                    if len([x for x in [sub_stat, int_stat, sup_stat] if x <= 0.05]) > 1:
-                        pval = min([sub_stat, int_stat, sup_stat])
-            
-            outline = ('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n').format(taxa, sub_s, int_s, sup_s, sub_stat, int_stat, sup_stat, pval)
-            all_outfile.write(outline)
-        
-    all_outfile.close()
+    write_abundance_table(('all_unnormalized_taxa_abundance_{}.tab').format(taxa_cutoff_name), taxa_names, raw_sums)
+    write_abundance_table(('all_normalized_taxa_abundance_{}.tab').format(taxa_cutoff_name), taxa_names, cor_sums)
     
     #        
     taxa_outfile_name = ('site_specific_{}_enrichment.tab').format(taxa_cutoff_name)
     outfile = open(taxa_outfile_name, 'w')
-    #taxa, uid, pval, p_1v2, p_1v3, p_1v4, p_2v3, p_2v4, p_3v4
-    header = ('#taxa\tuid\tpval\tmedian_log_10_sub\tmedian_log_10_inter\tmedian_log_10_supra\tpval_sub_inter\tpval_sub_supra\tpval_inter_supra\tishow\n')
+    header = ('#taxa\tuid\tpval\t{}\t{}\tishow\n').format(
+        '\t'.join([('median_log_10_{}').format(group.lower()) for group in groups]),
+        '\t'.join([('pval_{}_{}').format(groups[x_group].lower(), groups[y_group].lower()) for x_group, y_group in group_pairs]))
     outfile.write(header)
     
-    plot_top10_taxa(taxa_dict, 'normalized', 0.01)
-    plot_top10_taxa(taxa_raw_dict, 'un_normalized', 0.01)
+    plot_top10_taxa(taxa_names, cor_matrix, group_totals, 'normalized', 0.01)
+    plot_top10_taxa(taxa_names, raw_matrix, group_totals, 'un_normalized', 0.01)
     
     uid = 0
     
-    max_obs = 0
     figure_dict = {}
     
     dotplot_dict = {}
-
-    total_ct = taxa_dict['total'][0]    
-    total_g = taxa_dict['total'][1]
-    total_ol = taxa_dict['total'][2]
-    
-    total_observed = taxa_dict['observed']
     
     unique_dict = {}
-        
-    for taxa in taxa_set:                        
+    
+    #per taxa and group, for every taxa at once
+    cor_logs = log10_matrix(cor_matrix)
+    cor_means = cor_sums/group_sizes
+    log_means = group_reduce(cor_logs)/group_sizes
+    log_medians = group_medians(cor_logs)
+    observed = cor_matrix.max(axis=1) > 100
+    
+    #unique function, a group with >= 20 reads (>= 10 in at least two samples) where another group has none
+    raw_zero = (raw_sums == 0)
+    other_zero = (raw_zero.sum(axis=1, keepdims=True) - raw_zero) > 0
+    replicates_10 = group_reduce((raw_matrix >= 10).astype(float))
+    unique = observed & ((raw_sums >= 20) & other_zero & (replicates_10 >= 2)).any(axis=1)
+    
+    #chi-square tests for all the observed taxa in one go, across the sites and for every pair of sites
+    group_less = group_totals - cor_sums
+    tested_rows = [row for row, taxa in enumerate(taxa_names) if (taxa in taxa_set) and observed[row]]
+    
+    site_pvals = np.ones(len(taxa_names))
+    site_pvals[tested_rows] = chi2_pvalues(contingency_tables(cor_sums[tested_rows], group_less[tested_rows]))
+    
+    pair_pvals_matrix = np.zeros((len(taxa_names), len(group_pairs)))
+    if stats_runmode != 'kruskal_wallis':
+        for pair_index, pair in enumerate(group_pairs):
+            pair_pvals_matrix[tested_rows, pair_index] = chi2_kx2_pvalues(cor_sums[tested_rows][:, pair], group_less[tested_rows][:, pair])
+    
+    for row, taxa in enumerate(taxa_names):
         #bonferroni_corrected_pvalue = 0.05
-        if taxa in taxa_dict:
-            #
-            ct_r_array, ct_mean, ct_std, ct_set, ct_obs = return_deets(taxa_raw_dict[taxa][0], taxa_dict[taxa][0])
-            g_r_array, g_mean, g_std, g_set, g_obs = return_deets(taxa_raw_dict[taxa][1], taxa_dict[taxa][1])
-            ol_r_array, ol_mean, ol_std, ol_set, ol_obs = return_deets(taxa_raw_dict[taxa][2], taxa_dict[taxa][2])
-            #
-            ct_array, ct_mean, ct_std, ct_set, ct_obs = return_deets(taxa_dict[taxa][0], taxa_dict[taxa][0])
-            g_array, g_mean, g_std, g_set, g_obs = return_deets(taxa_dict[taxa][1], taxa_dict[taxa][1])
-            ol_array, ol_mean, ol_std, ol_set, ol_obs = return_deets(taxa_dict[taxa][2], taxa_dict[taxa][2])
-            
-            #unique function
-            if ct_obs or g_obs or ol_obs:                
-                if (sum(ct_r_array) >= 20 and sum(g_r_array) == 0) or (sum(ct_r_array) >= 20 and sum(ol_r_array) == 0):
-                    ct = 0
-                    for each in ct_r_array:
-                        if each >= 10:
-                            ct+=1
-                            
-                    if ct >= 2:
-                        unique_dict[taxa]=[np.mean(return_log10(ct_array)), np.mean(return_log10(g_array)), np.mean(return_log10(ol_array))] 
-                
-                if (sum(g_r_array) >= 20 and sum(ct_r_array) == 0) or (sum(g_r_array) >= 20 and sum(ol_r_array) == 0): 
-                    ct = 0
-                    for each in g_r_array:
-                        if each >= 10:
-                            ct+=1
-                            
-                    if ct >= 2:
-                        unique_dict[taxa]=[np.mean(return_log10(ct_array)), np.mean(return_log10(g_array)), np.mean(return_log10(ol_array))] 
-                
-                if (sum(ol_r_array) >= 20 and sum(g_r_array) == 0) or (sum(ol_r_array) >= 20 and sum(ct_r_array) == 0):
-                    ct = 0
-                    for each in ol_r_array:
-                        if each >= 10:
-                            ct+=1
-                            
-                    if ct >= 2:
-                        unique_dict[taxa]=[np.mean(return_log10(ct_array)), np.mean(return_log10(g_array)), np.mean(return_log10(ol_array))] 
+        if taxa in taxa_set:
+            if unique[row]:
+                unique_dict[taxa] = log_means[row].tolist()
                 
             #                                      
-            if ct_obs or g_obs or ol_obs:
-                p_1v2, p_1v3, p_2v3 = 0, 0, 0
-                ct_sum, g_sum, ol_sum = sum(ct_array), sum(g_array), sum(ol_array)
-                ct_less, g_less, ol_less = (total_ct - ct_sum), (total_g - g_sum), (total_ol - ol_sum)
+            if observed[row]:
+                pval = site_pvals[row]
                 
-                obs = np.array([[max(g_sum,1), g_less], [max(ct_sum,1), ct_less], [max(ol_sum,1), ol_less]])
-                chi2, pval, dof, expected = stats.chi2_contingency(obs, correction=True)
+                group_sets = [cor_matrix[row, start:start+group_sizes[group_index]].tolist() for group_index, start in enumerate(group_starts)]
+                pair_pvals = pair_pvals_matrix[row].tolist()
                                               
                 #stats_runmode = 'kruskal_wallis'
                 
                 if stats_runmode == 'kruskal_wallis':
-                    pval = run_kruskal_3way(ct_set, g_set, ol_set)
+                    pval = run_kruskal_groups(group_sets)
                     pass_criteria = False
                     if pval <= 0.05:
                         pass_criteria = True
                       
                 else:
-                    p_1v2 = run_chi2(ct_sum, ct_less, g_sum, g_less)
-                    p_1v3 = run_chi2(ct_sum, ct_less, ol_sum, ol_less)
-                    p_2v3 = run_chi2(g_sum, g_less, ol_sum, ol_less)
-                    pass_criteria = criteria(ct_array, g_array, ol_array, p_1v2, p_1v3, p_2v3, pval, taxa, pct_effect_size, pval_threshold)
+                    pass_criteria = criteria(cor_sums[row].sum(), cor_means[row], pair_pvals, pval, taxa, pct_effect_size, pval_threshold)
                 
                 if pass_criteria:
-                    log_ct_set = return_log10(ct_array)
-                    log_g_set = return_log10(g_array)
-                    log_ol_set = return_log10(ol_array)
-                    
-                    max_obs = test_max([log_ct_set, log_g_set, log_ol_set], max_obs)
-                    
-                    clog_ct_set = log_ct_set
-                    clog_g_set = log_g_set
-                    clog_ol_set = log_ol_set
+                    log_sets = [cor_logs[row, start:start+group_sizes[group_index]].tolist() for group_index, start in enumerate(group_starts)]
                     
-                    if (len(clog_ct_set)+len(clog_g_set)+len(clog_ol_set)) >= 3:
-                        if clog_ol_set:
-                            med_log_ol = np.median(clog_ol_set)
-                        else:
-                            med_log_ol = 0
-                            
-                        if clog_g_set:
-                            med_log_g = np.median(clog_g_set)
-                        else:
-                            med_log_g = 0
-
-                        if clog_ct_set:
-                            med_log_ct = np.median(clog_ct_set)
-                        else:
-                            med_log_ct = 0
+                    if sum(group_sizes) >= 3:
+                        group_meds = log_medians[row].tolist()
                         
                         if taxa not in figure_dict:
                             pass_dict['figure_dict']+=1
-                            figure_dict[taxa] = [clog_ct_set, clog_g_set, clog_ol_set]
+                            figure_dict[taxa] = log_sets
                         else:
                             print('error')
                             1/0
                         
-                        is_how = simplify_enrichment(taxa, p_1v2, p_1v3, p_2v3, med_log_ct, med_log_g, med_log_ol)
+                        is_how = simplify_enrichment(taxa, pair_pvals, group_meds)
                         
                         if is_how != 'complex':
-                            outline = ('{taxa}\t{uid}\t{pval}\t{median_ct}\t{median_g}\t{median_ol}\t{pv12}\t{pv13}\t{pv23}\t{is_how}\n').format(taxa=taxa, uid=uid, pval=pval, median_ct=med_log_ct, median_g=med_log_g, median_ol=med_log_ol, pv12=p_1v2, pv13=p_1v3, pv23=p_2v3, is_how=is_how)
+                            outline = ('{taxa}\t{uid}\t{pval}\t{medians}\t{pvals}\t{is_how}\n').format(taxa=taxa, uid=uid, pval=pval, medians='\t'.join([str(each) for each in group_meds]), pvals='\t'.join([str(each) for each in pair_pvals]), is_how=is_how)
                             print(outline)
                             outfile.write(outline)
                             
                         uid += 1  
                         if taxa not in dotplot_dict:
-                            dotplot_dict[taxa] = [med_log_ct, med_log_g, med_log_ol]
+                            dotplot_dict[taxa] = group_meds
                             
                         else:
                             print('taxa conflict', taxa)
+    
+    outfile.close()
                            
     if unique_dict:
-        import plotly.graph_objects as go
-        
-        taxa_by_site_list = []
-        site_abundance_dict = {'CT':[], 'G':[], 'OL':[]}
-        
         taxa_list = list(unique_dict.keys())
         taxa_list.sort(reverse=True)
             
-        for taxa in taxa_list:
-            sites = unique_dict[taxa]
-            taxa_by_site_list.append(taxa)
-            site_abundance_dict['CT'].append(sites[0])
-            site_abundance_dict['G'].append(sites[1])
-            site_abundance_dict['OL'].append(sites[2])
-            
         outfile_name = ('_unique_{}_.pdf').format(taxa_cutoff_name)
-            
-        fig = go.Figure()
-        fig.add_trace(go.Scatter(
-            y=taxa_by_site_list,
-            x=site_abundance_dict['CT'],
-            marker=dict(color='rgba(0, 89, 255, 0.5)', size=10),
-            mode="markers",
-            name="Sub",
-        ))
-                
-        fig.add_trace(go.Scatter(
-            y=taxa_by_site_list,
-            x=site_abundance_dict['G'],
-            marker=dict(color='rgba(255, 165, 0, 0.5)', size=10),
-            mode="markers",
-            name="Inter",
-        ))
-
-        fig.add_trace(go.Scatter(
-            y=taxa_by_site_list,
-            x=site_abundance_dict['OL'],
-            marker=dict(color='rgba(0, 0, 0, 0.5)', size=10),
-            mode="markers",
-            name="Sup",
-        ))
-
-        fig.update_layout(title='Site specific taxonomic differentials',
-                          xaxis_title="Median Log10 Taxa Abundance",
-                          yaxis_title="Taxa",
-                          font_size=10,
-                          width=1500,
-                          height=1500)
-        
-        fig.write_image(outfile_name)     
         
+        plot_group_scatter(taxa_list, [unique_dict[taxa] for taxa in taxa_list], 'Site specific taxonomic differentials', "Median Log10 Taxa Abundance", outfile_name)
         
     if figure_dict:
         #build_x_y()          
         for taxa, set_list in figure_dict.items():
             
-            global_x_data = []
-            global_y_data = []
-            global_colors = []
-            
             if '/' in taxa:
                 taxa = taxa.replace('/','_or_')
             
-            ct_tag = ('{}_{}_Sub').format(taxa_cutoff_name, taxa)
-            g_tag = ('{}_{}_Inter').format(taxa_cutoff_name, taxa)
-            ol_tag = ('{}_{}_Sup').format(taxa_cutoff_name, taxa)
-             
-            x_data = ct_tag, g_tag, ol_tag
-            
-            ct_set = mod_null_set(set_list[0])            
-            g_set = mod_null_set(set_list[1])
-            ol_set = mod_null_set(set_list[2])
-                    
-            outfile.close()
-                                                           
-            y_data = ct_set, g_set, ol_set
-            
-            colors = 'rgba(0, 89, 255 0.5)', 'rgba(255, 165, 0, 0.5)', 'rgba(0, 0, 0, 0.5)',
-            
-            global_x_data += x_data
-            global_y_data += y_data
-            global_colors += colors
-            
             fig = go.Figure()
             
             outfile_name = ('site_specific_{}_{}_enrichment.pdf').format(taxa_cutoff_name, taxa)
             print(outfile_name)
             
-            for xd, yd, cls in zip(global_x_data, global_y_data, global_colors):
+            for group_index, group in enumerate(groups):
+                    cls = group_color(group_index)
                     fig.add_trace(go.Box(
-                        y=yd,
-                        name=xd,
+                        y=mod_null_set(set_list[group_index]),
+                        name=('{}_{}_{}').format(taxa_cutoff_name, taxa, group),
                         boxpoints='all',
                         notched=True,
                         jitter=0.5,
@@ -845,53 +716,9 @@ for taxa_cutoff_name in rank_order:
             fig.write_image(outfile_name)
     
     if dotplot_dict:
-        import plotly.graph_objects as go
-        
-        taxa_by_site_list = []
-        site_abundance_dict = {'CT':[], 'G':[], 'OL':[]}
-        
         taxa_list = list(dotplot_dict.keys())
         taxa_list.sort(reverse=True)
             
-        for taxa in taxa_list:
-            sites = dotplot_dict[taxa]
-            taxa_by_site_list.append(taxa)
-            site_abundance_dict['CT'].append(sites[0])
-            site_abundance_dict['G'].append(sites[1])
-            site_abundance_dict['OL'].append(sites[2])
-            
         outfile_name = ('_site_specific_spread_{}_.pdf').format(taxa_cutoff_name)
-            
-        fig = go.Figure()
-        fig.add_trace(go.Scatter(
-            y=taxa_by_site_list,
-            x=site_abundance_dict['CT'],
-            marker=dict(color='rgba(0, 89, 255 0.5)', size=10),
-            mode="markers",
-            name="Sublittoral",
-        ))
-                
-        fig.add_trace(go.Scatter(
-            y=taxa_by_site_list,
-            x=site_abundance_dict['G'],
-            marker=dict(color='rgba(255, 165, 0, 0.5)', size=10),
-            mode="markers",
-            name="Intertidal",
-        ))
-
-        fig.add_trace(go.Scatter(
-            y=taxa_by_site_list,
-            x=site_abundance_dict['OL'],
-            marker=dict(color='rgba(0, 0, 0, 0.5)', size=10),
-            mode="markers",
-            name="Supralittoral",
-        ))
-
-        fig.update_layout(title='Site specific taxonomic differentials',
-                          xaxis_title="Median Log10 Taxa Abundance",
-                          yaxis_title="Taxa",
-                          font_size=10,
-                          width=1500,
-                          height=1500)
         
-        fig.write_image(outfile_name)     
\ No newline at end of file
+        plot_group_scatter(taxa_list, [dotplot_dict[taxa] for taxa in taxa_list], 'Site specific taxonomic differentials', "Median Log10 Taxa Abundance", outfile_name)
@@ -22,6 +22,8 @@ Version: Beta 0.5 (Restaurant Dismiss): added versatility
 Version: Beta 0.6 (Obscure Threat): added summative taxonomic levels
 Version: Beta 0.7 (Leader Route):
     _x_ added asv2fa function to directly calculate the functional abundance of any taxa
+Version: Beta 0.8 (Batch Count):
+    _x_ pathway_enrichment runs its chi-square site tests in batches (batch_stats.py)
 
     
 python scripts/sigilo.py --generate_heatmap -i picrust2_out_pipeline/KO_metagenome_out/pred_metagenome_unstrat.tsv -sig Aldex_results/aldex_significant_all_glm.ep_KO.csv -k metadata/ko00001.keg -o sigilo_results/
@@ -71,6 +73,8 @@ import numpy as np
 import scipy.stats as stats
 import pickle
 
+from batch_stats import chi2_kx2_pvalues
+
 if args.taxa_source:
     taxa_source = args.taxa_source
 else:
@@ -726,23 +730,6 @@ def try_kruskal(p_is, s_is, v_is):
             
     return(False)
     
-def run_chi2(x_num, x_den, y_num, y_den):
-    if (x_num) > 5 or (y_num) > 5:
-        obs = np.array([[max(x_num,1), x_den], [max(y_num,1), y_den]])
-        chi2, pval, dof, expected = stats.chi2_contingency(obs, correction=True)
-        return(pval)
-    else:
-        return(1)
-        
-def run_chi2x3(x_num, x_den, y_num, y_den, z_num, z_den):
-    if (x_num) > 5 or (y_num) > 5 or (z_num) > 5:
-        obs = np.array([[max(x_num,1), x_den], [max(y_num,1), y_den], [max(z_num,1), z_den]])
-        chi2, pval, dof, expected = stats.chi2_contingency(obs, correction=True)
-        return(pval)
-    else:
-        return(1)
-        
-        
 def clean_up_name(name):
     name = name.strip()
     
@@ -852,6 +839,9 @@ def pathway_build(taxa_cutoff_name, pct_threshold=0.05, pval_threshold=0.05):
                             pathway_round[level][taxon][pathway][site][ko].append(taxa_fa) 
                             
                                                     
+    #every taxon x pathway is set up first, so their chi-square tests run as one batch
+    pathway_sets = []
+    
     for level in pathway_round:
         for taxon in pathway_round[level]:
             for pathway in pathway_round[level][taxon]:
@@ -888,68 +878,101 @@ def pathway_build(taxa_cutoff_name, pct_threshold=0.05, pval_threshold=0.05):
                 p_is = fill_out(p_is, max([len(p_is), len(s_is), len(v_is)]))
                 s_is = fill_out(s_is, max([len(p_is), len(s_is), len(v_is)]))
                 v_is = fill_out(v_is, max([len(p_is), len(s_is), len(v_is)]))
+                
+                ko_list = list(pathway_round[level][taxon][pathway][site].keys())
+                
+                pathway_sets.append({'level': level, 'taxon': taxon, 'pathway': pathway, 'uname': uname,
+                                     'temp_path': temp_path, 'temp_total': temp_total, 'ko': ko_list,
+                                     'is': (p_is, s_is, v_is), 'den': (p_den, s_den, v_den)})
                                 
-                runmode = 'chi2x3'
-                if runmode == 'kruskal':
-                    if try_kruskal(p_is, s_is, v_is):
-                        _stat, pval = stats.kruskal(p_is, s_is, v_is)                    
-                    else:
-                        pval = 1
-                else:
-                    pval = run_chi2x3(sum(p_is), p_den, sum(s_is), s_den, sum(v_is), v_den)
-
-                if pval*correction <= pval_threshold:
-                    valcheck = set()
-                    site_set = set()
-                    for site in temp_path:
-                        if len(temp_path[site]) >= 3:
-                            site_set.add(site)
-                            
-                    for x_site in site_set:
-                        for y_site in site_set:
-                            if x_site != y_site:
-                                x_set = temp_path[x_site]
-                                y_set = temp_path[y_site]
-                                
-                                x_den = temp_total[x_site]
-                                y_den = temp_total[y_site]
-                                
-                                if (sum(x_set) >= pct_threshold*x_den) or (sum(y_set) >= pct_threshold*y_den):
-                                
-                                    if runmode == 'kruskal':
-                                        pval_2 = run_mwu(x_set, y_set)
-                                    else:
-                                        pval_2 = run_chi2(sum(x_set), x_den, sum(y_set), y_den)
-                                    
-                                    if (np.median(y_set) == 0):
-                                        x_ratio = np.median(x_set)
-                                    else:
-                                        x_ratio = np.median(x_set)/np.median(y_set)
-                                    
-                                    if (np.median(x_set) == 0):
-                                        y_ratio = np.median(y_set)
-                                    else:
-                                        y_ratio = np.median(y_set)/np.median(x_set)
-                                        
-                                    if ((pval_2*correction) <= pval_threshold) and ((x_ratio >= 1+pct_threshold) or (y_ratio >= 1+pct_threshold)):
-                                        print(pval, pval_2, x_ratio, y_ratio)
-                                        checkname = ('{}v{}').format(min(x_site,y_site),max(x_site,y_site))
-                                        valcheck.add(checkname)
-                        
-                    if len(valcheck) >= 2:
-                        p_pct = sum(p_is)/p_den
-                        s_pct = sum(s_is)/s_den
-                        v_pct = sum(v_is)/v_den                                    
-                        outline = ('{level}\t{taxon}\t{pathway}\t{pval}\t{p_is}\t{p_den}\t{s_is}\t{s_den}\t{v_is}\t{v_den}\t{ko}\n').format(level=level, taxon=taxon, pathway=pathway, pval=(pval*correction), p_is=sum(p_is), p_den=p_den, s_is=sum(s_is), s_den=s_den, v_is=sum(v_is), v_den=v_den, ko=list(pathway_round[level][taxon][pathway][site].keys()))
- 
-                        outfile.write(outline)
-                        pval_ct+=1
+    runmode = 'chi2x3'
+    if runmode == 'kruskal':
+        pvals = []
+        for pathway_set in pathway_sets:
+            p_is, s_is, v_is = pathway_set['is']
+            if try_kruskal(p_is, s_is, v_is):
+                _stat, pval = stats.kruskal(p_is, s_is, v_is)                    
+            else:
+                pval = 1
+            pvals.append(pval)
+    else:
+        pvals = chi2_kx2_pvalues([[sum(each_is) for each_is in pathway_set['is']] for pathway_set in pathway_sets],
+                                 [pathway_set['den'] for pathway_set in pathway_sets]).tolist()
+    
+    #the site pairs of every pathway that passed, tested as a second batch
+    pair_tests = []
+    
+    for set_index, (pathway_set, pval) in enumerate(zip(pathway_sets, pvals)):
+        pathway_set['pval'] = pval
+        
+        if pval*correction <= pval_threshold:
+            temp_path = pathway_set['temp_path']
+            temp_total = pathway_set['temp_total']
+            
+            site_set = set()
+            for site in temp_path:
+                if len(temp_path[site]) >= 3:
+                    site_set.add(site)
+                    
+            for x_site in site_set:
+                for y_site in site_set:
+                    if x_site != y_site:
+                        x_set = temp_path[x_site]
+                        y_set = temp_path[y_site]
                         
-                        if uname in plot_round:
-                            print('uname duplicate', plot_round[uname])
+                        x_den = temp_total[x_site]
+                        y_den = temp_total[y_site]
                         
-                        plot_round[uname]={'P':p_is, 'S': s_is, 'V': v_is, 'ko':list(pathway_round[level][taxon][pathway][site].keys())}
-                        pct_round[uname]={'P':p_pct, 'S': s_pct, 'V': v_pct, 'ko':list(pathway_round[level][taxon][pathway][site].keys())}
+                        if (sum(x_set) >= pct_threshold*x_den) or (sum(y_set) >= pct_threshold*y_den):
+                            pair_tests.append((set_index, x_site, y_site))
+    
+    if runmode == 'kruskal':
+        pair_pvals = [run_mwu(pathway_sets[set_index]['temp_path'][x_site], pathway_sets[set_index]['temp_path'][y_site]) for set_index, x_site, y_site in pair_tests]
+    else:
+        pair_pvals = chi2_kx2_pvalues([[sum(pathway_sets[set_index]['temp_path'][x_site]), sum(pathway_sets[set_index]['temp_path'][y_site])] for set_index, x_site, y_site in pair_tests],
+                                      [[pathway_sets[set_index]['temp_total'][x_site], pathway_sets[set_index]['temp_total'][y_site]] for set_index, x_site, y_site in pair_tests]).tolist()
+    
+    for (set_index, x_site, y_site), pval_2 in zip(pair_tests, pair_pvals):
+        pathway_set = pathway_sets[set_index]
+        x_set = pathway_set['temp_path'][x_site]
+        y_set = pathway_set['temp_path'][y_site]
+        
+        if (np.median(y_set) == 0):
+            x_ratio = np.median(x_set)
+        else:
+            x_ratio = np.median(x_set)/np.median(y_set)
+        
+        if (np.median(x_set) == 0):
+            y_ratio = np.median(y_set)
+        else:
+            y_ratio = np.median(y_set)/np.median(x_set)
+            
+        if ((pval_2*correction) <= pval_threshold) and ((x_ratio >= 1+pct_threshold) or (y_ratio >= 1+pct_threshold)):
+            print(pathway_set['pval'], pval_2, x_ratio, y_ratio)
+            checkname = ('{}v{}').format(min(x_site,y_site),max(x_site,y_site))
+            pathway_set.setdefault('valcheck', set()).add(checkname)
+    
+    for pathway_set in pathway_sets:
+        uname = pathway_set['uname']
+        
+        if len(pathway_set.get('valcheck', ())) >= 2:
+            level, taxon, pathway, pval = pathway_set['level'], pathway_set['taxon'], pathway_set['pathway'], pathway_set['pval']
+            p_is, s_is, v_is = pathway_set['is']
+            p_den, s_den, v_den = pathway_set['den']
+            
+            p_pct = sum(p_is)/p_den
+            s_pct = sum(s_is)/s_den
+            v_pct = sum(v_is)/v_den                                    
+            outline = ('{level}\t{taxon}\t{pathway}\t{pval}\t{p_is}\t{p_den}\t{s_is}\t{s_den}\t{v_is}\t{v_den}\t{ko}\n').format(level=level, taxon=taxon, pathway=pathway, pval=(pval*correction), p_is=sum(p_is), p_den=p_den, s_is=sum(s_is), s_den=s_den, v_is=sum(v_is), v_den=v_den, ko=pathway_set['ko'])
+ 
+            outfile.write(outline)
+            pval_ct+=1
+            
+            if uname in plot_round:
+                print('uname duplicate', plot_round[uname])
+            
+            plot_round[uname]={'P':p_is, 'S': s_is, 'V': v_is, 'ko':pathway_set['ko']}
+            pct_round[uname]={'P':p_pct, 'S': s_pct, 'V': v_pct, 'ko':pathway_set['ko']}
                         
     
     pickle_name = ('pct_{}_{}.p').format(args.output_file, taxa_cutoff_name)